@@ -0,0 +1,61 @@
+"""Latency and recall@k of the binary (sign-bit) first stage with exact re-ranking vs the flat index.
+
+Run from Backend/:
+
+    python -m benchmarks.binary_index --sizes 100000 500000 --k 10
+
+The flat row is the current exact path. Binary rows scan 1 bit per dimension by Hamming
+distance and re-rank factor x k candidates against the float vectors, read from a memmap
+of vectors.npy as at query time; "none" is the Hamming ranking alone. The row marked * is
+the re-rank factor index_builder.build_index tunes for that size. Isotropic noise around
+the cluster centres is a hard case for sign bits; real embeddings keep more of their
+neighbourhood structure in the signs.
+"""
+import argparse
+import os
+import tempfile
+
+import numpy as np
+
+from benchmarks.index_types import DIMENSIONS, clustered_corpus, latency_ms
+from index_builder import RerankIndex, build_index, exact_neighbors, recall_at_k
+
+FLOAT_BYTES = DIMENSIONS * 4
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 300000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank-factors", type=int, nargs="+", default=[2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'vectors':>8} {'index':<7} {'rerank':>7} {'B/vector':>9} {'recall@k':>9} {'ms/query':>9}")
+    for n in args.sizes:
+        vectors, queries = clustered_corpus(n, args.queries, max(10, n // 2000), rng)
+        truth = exact_neighbors(vectors, queries, args.k)
+
+        flat, _ = build_index(vectors, kind="flat")
+        print(f"{n:>8} {'flat':<7} {'-':>7} {FLOAT_BYTES:>9} {recall_at_k(flat, queries, truth, args.k):>9.3f} "
+              f"{latency_ms(flat, queries, args.k):>9.3f}")
+        del flat
+
+        binary, config = build_index(vectors, kind="binary")
+        with tempfile.TemporaryDirectory() as tmp:
+            vectors_path = os.path.join(tmp, "vectors.npy")
+            np.save(vectors_path, vectors)
+            on_disk = np.load(vectors_path, mmap_mode="r")
+            bytes_per_vector = binary.binary.code_size
+            factors = sorted(set(args.rerank_factors) | {config["rerank_factor"]})
+            variants = [("none", binary)] + [(f"x{f}", RerankIndex(binary, on_disk, factor=f)) for f in factors]
+            for label, searched in variants:
+                recall = recall_at_k(searched, queries, truth, args.k)
+                marker = "*" if label == f"x{config['rerank_factor']}" else " "
+                print(f"{n:>8} {'binary':<7} {label:>7} {bytes_per_vector:>9} {recall:>9.3f} "
+                      f"{latency_ms(searched, queries, args.k):>9.3f}{marker}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Memory vs recall report for product-quantized indices with and without exact re-ranking.
+
+Run from Backend/:
+
+    python -m benchmarks.compressed_indices --vectors 100000 --k 10
+
+For each configuration prints the in-RAM bytes per vector (the serialized index), the
+compression ratio against 768-dim float32, recall@k against exact search and query latency.
+Re-ranked rows also read the float vectors from disk (a memmap of vectors.npy).
+"""
+import argparse
+import os
+import tempfile
+
+import faiss
+import numpy as np
+
+from benchmarks.index_types import DIMENSIONS, clustered_corpus, latency_ms
+from index_builder import RerankIndex, build_index, exact_neighbors, recall_at_k, set_search_params
+
+FLOAT_BYTES = DIMENSIONS * 4
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--pq-bytes", type=int, nargs="+", default=[96, 192])
+    parser.add_argument("--rerank-factors", type=int, nargs="+", default=[4, 10])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors, queries = clustered_corpus(args.vectors, args.queries, max(10, args.vectors // 2000), rng)
+    truth = exact_neighbors(vectors, queries, args.k)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        vectors_path = os.path.join(tmp, "vectors.npy")
+        np.save(vectors_path, vectors)
+        on_disk = np.load(vectors_path, mmap_mode="r")
+
+        rows = [("flat", {}), ("ivf", {})]
+        rows += [(kind, {"pq_bytes": m}) for kind in ("ivfpq", "opq") for m in args.pq_bytes]
+        print(f"{args.vectors} vectors, {DIMENSIONS} dims, k={args.k}")
+        print(f"{'index':<18} {'rerank':>7} {'B/vector':>9} {'ratio':>7} {'recall@k':>9} {'ms/query':>9}")
+        for kind, options in rows:
+            index, config = build_index(vectors, kind=kind, **options)
+            bytes_per_vector = faiss.serialize_index(index).nbytes / args.vectors
+            label = f"{kind}{options.get('pq_bytes', '')}"
+            variants = [("-", index)]
+            if kind in ("ivfpq", "opq"):
+                variants = [("none", index)] + [
+                    (f"x{factor}", RerankIndex(index, on_disk, factor=factor)) for factor in args.rerank_factors
+                ]
+            for rerank, searched in variants:
+                set_search_params(searched, config)
+                recall = recall_at_k(searched, queries, truth, args.k)
+                print(f"{label:<18} {rerank:>7} {bytes_per_vector:>9.0f} {FLOAT_BYTES / bytes_per_vector:>6.1f}x "
+                      f"{recall:>9.3f} {latency_ms(searched, queries, args.k):>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import glob
+import os
+import random
+from typing import List
+
+TITLES = [
+    "Professional Experience", "Education", "Technical Skills", "Projects", "Certifications",
+    "Executive Summary", "Quarterly Results", "Risk Factors", "Methodology", "Appendix A",
+]
+SKILLS = [
+    "Python", "FastAPI", "PostgreSQL", "Docker", "Kubernetes", "AWS S3", "PyTorch", "FAISS",
+    "React", "Terraform", "CI/CD", "NLP", "LangChain", "Redis", "GraphQL", "Spark",
+]
+SENTENCES = [
+    "Led a team of five engineers to rebuild the ingestion pipeline, cutting processing time by 40%.",
+    "Designed REST APIs serving two million requests per day with a p99 latency under 120 ms.",
+    "Revenue for the quarter grew 12% year over year, driven primarily by the enterprise segment.",
+    "The committee reviewed operational risks including vendor concentration and data retention.",
+    "Implemented retrieval-augmented generation over internal documentation using dense embeddings.",
+    "Migrated legacy batch jobs to an event-driven architecture with idempotent consumers.",
+    "Survey responses were weighted by region to correct for sampling bias in the rural cohort.",
+    "Mentored junior developers and introduced code review guidelines adopted across the org.",
+]
+
+
+def mixed_chunks(count: int, seed: int = 7) -> List[str]:
+    """Return `count` resume/report-like chunks with the length mix `create_chunks` produces.
+
+    Roughly a third are one-line titles or skill lists, the rest are narrative chunks of
+    up to ~1000 characters, interleaved in document order.
+    """
+    rng = random.Random(seed)
+    chunks = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.2:
+            chunks.append(rng.choice(TITLES))
+        elif kind < 0.35:
+            chunks.append(", ".join(rng.sample(SKILLS, rng.randint(3, 8))))
+        else:
+            text = ""
+            target = rng.randint(200, 1000)
+            while len(text) < target:
+                text += rng.choice(SENTENCES) + " "
+            chunks.append(text[:1000].strip())
+    return chunks
+
+
+def uploaded_chunks(uploads_dir: str = "uploads") -> List[str]:
+    """Chunk the PDFs under `uploads_dir` with the production DocumentProcessor, if any exist."""
+    from unstructured_nlp import DocumentProcessor
+
+    if not glob.glob(os.path.join(uploads_dir, "*")):
+        return []
+    processor = DocumentProcessor(uploads_dir=uploads_dir)
+    return [chunk.page_content for chunk in processor.create_chunks(processor.process_documents())]
@@ -0,0 +1,83 @@
+"""Parity check and throughput benchmark for the ONNX embedding backends.
+
+Run from Backend/:
+
+    python -m benchmarks.embedding_backends --backends onnx onnx-int8 --chunks 512
+
+Every backend is compared against the PyTorch (sentence-transformers) vectors. The script
+exits non-zero if the worst per-chunk cosine drift of any backend exceeds --max-drift.
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import psutil
+
+from benchmarks.corpus import mixed_chunks, uploaded_chunks
+from embeddings import EMBEDDING_MODEL_NAME, registry
+
+# Largest 1 - cosine(torch, backend) allowed for any chunk; tests/test_embedding_backends.py checks it too.
+MAX_DRIFT = 0.02
+
+
+def cosine_drift(reference: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    """Per-row 1 - cosine between two sets of L2-normalised vectors."""
+    return 1.0 - np.sum(reference * vectors, axis=1)
+
+
+def encode(backend: str, texts):
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+    model = registry.get(EMBEDDING_MODEL_NAME, backend)
+    model.model.embed_documents(texts[:8])  # warm up kernels outside the timed region
+    rss_after_load = process.memory_info().rss
+
+    start = time.perf_counter()
+    vectors = np.asarray(model.embed_documents(texts), dtype=np.float32)
+    seconds = time.perf_counter() - start
+    return vectors, {
+        "backend": backend,
+        "load_seconds": model.load_seconds,
+        "load_rss_mb": (rss_after_load - rss_before) / 2**20,
+        "chunks_per_second": len(texts) / seconds,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["onnx", "onnx-int8"])
+    parser.add_argument("--chunks", type=int, default=512)
+    parser.add_argument("--max-drift", type=float, default=MAX_DRIFT,
+                        help="maximum allowed 1 - cosine(torch, backend) for any chunk")
+    args = parser.parse_args()
+
+    texts = uploaded_chunks() or mixed_chunks(args.chunks)
+    texts = (texts * (args.chunks // max(len(texts), 1) + 1))[:args.chunks]
+
+    reference, baseline = encode("torch", texts)
+    results = [baseline]
+    failed = False
+    for backend in args.backends:
+        vectors, result = encode(backend, texts)
+        drift = cosine_drift(reference, vectors)
+        result["mean_drift"] = float(drift.mean())
+        result["max_drift"] = float(drift.max())
+        result["speedup"] = result["chunks_per_second"] / baseline["chunks_per_second"]
+        failed |= result["max_drift"] > args.max_drift
+        results.append(result)
+
+    print(f"{len(texts)} chunks, model {EMBEDDING_MODEL_NAME}")
+    print(f"{'backend':<10} {'load s':>7} {'load MB':>8} {'chunks/s':>9} {'speedup':>8} {'mean drift':>11} {'max drift':>10}")
+    for r in results:
+        print(f"{r['backend']:<10} {r['load_seconds']:>7.2f} {r['load_rss_mb']:>8.0f} {r['chunks_per_second']:>9.1f} "
+              f"{r.get('speedup', 1.0):>7.2f}x {r.get('mean_drift', 0.0):>11.5f} {r.get('max_drift', 0.0):>10.5f}")
+
+    if failed:
+        print(f"FAIL: cosine drift above {args.max_drift}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
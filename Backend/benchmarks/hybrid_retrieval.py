@@ -0,0 +1,97 @@
+"""Recall@k and latency of dense, BM25 and hybrid (reciprocal-rank fused) retrieval.
+
+Run from Backend/:
+
+    python -m benchmarks.hybrid_retrieval --candidates 300 --ks 1 3 5 10 20
+
+The corpus is synthetic resumes: each candidate has a name, an ID like "RX-0042" and a few
+skills, spread over the title / skill-list / narrative chunk mix of benchmarks.corpus.
+Queries are the keyword-heavy kind dense vectors struggle with (an ID, a name, a skill
+pair); a query counts as recalled at k if a chunk of the right candidate is in the top k.
+"""
+import argparse
+import random
+import time
+
+import faiss
+import numpy as np
+
+from benchmarks.corpus import SKILLS, mixed_chunks
+from embeddings import EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME, registry
+from sparse_index import BM25Index, reciprocal_rank_fusion
+
+FIRST_NAMES = ["Priya", "Marcus", "Elena", "Tomasz", "Aiko", "Dmitri", "Fatima", "Jonas", "Lucia", "Kwame"]
+LAST_NAMES = ["Raman", "Okafor", "Lindqvist", "Nowak", "Tanaka", "Petrov", "Haddad", "Berg", "Ferreira", "Mensah"]
+
+
+def resumes(candidates: int, seed: int = 3):
+    """(chunk texts, owning candidate per chunk, queries as (text, candidate))."""
+    rng = random.Random(seed)
+    filler = mixed_chunks(candidates * 4, seed=seed)
+    texts, owners, queries = [], [], []
+    for candidate in range(candidates):
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        identifier = f"RX-{candidate:04d}"
+        skills = rng.sample(SKILLS, 2)
+        texts += [
+            f"{name} ({identifier})",
+            f"Technical Skills: {', '.join(skills)}",
+            *filler[candidate * 4:candidate * 4 + 3],
+            f"{name} worked with {skills[0]} and {skills[1]}. {filler[candidate * 4 + 3][:300]}",
+        ]
+        owners += [candidate] * 6
+        queries += [
+            (f"What is the background of candidate {identifier}?", candidate),
+            (f"{identifier} experience", candidate),
+            (f"Does {name} ({identifier}) know {skills[0]}?", candidate),
+        ]
+    return texts, np.array(owners), queries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--candidates", type=int, default=300)
+    parser.add_argument("--ks", type=int, nargs="+", default=[1, 3, 5, 10, 20])
+    parser.add_argument("--backend", default=EMBEDDING_BACKEND)
+    args = parser.parse_args()
+
+    texts, owners, queries = resumes(args.candidates)
+    model = registry.get(EMBEDDING_MODEL_NAME, args.backend)
+    vectors = np.asarray(model.embed_documents(texts), dtype=np.float32)
+    query_vectors = np.asarray(model.embed_queries([text for text, _ in queries]), dtype=np.float32)
+    dense_index = faiss.IndexFlatL2(vectors.shape[1])
+    dense_index.add(vectors)
+    bm25_index = BM25Index().extend(0, texts)
+    depth = 2 * max(args.ks)
+
+    rankings = {"dense": [], "bm25": [], "hybrid": []}
+    seconds = {"dense": 0.0, "bm25": 0.0, "hybrid": 0.0}
+    for (text, _), query_vector in zip(queries, query_vectors):
+        start = time.perf_counter()
+        dense = dense_index.search(query_vector[None, :], depth)[1][0].tolist()
+        seconds["dense"] += time.perf_counter() - start
+        start = time.perf_counter()
+        sparse = [position for position, _ in bm25_index.search(text, depth)]
+        seconds["bm25"] += time.perf_counter() - start
+        start = time.perf_counter()
+        fused = [position for position, _ in reciprocal_rank_fusion([dense, sparse], depth)]
+        # Fusion itself plus the slower of the two searches, which run in parallel in production.
+        seconds["hybrid"] += time.perf_counter() - start
+        rankings["dense"].append(dense)
+        rankings["bm25"].append(sparse)
+        rankings["hybrid"].append(fused)
+    seconds["hybrid"] += max(seconds["dense"], seconds["bm25"])
+
+    print(f"{len(texts)} chunks, {len(queries)} keyword-heavy queries, {args.backend} backend")
+    print(f"{'method':<8} " + " ".join(f"{f'R@{k}':>7}" for k in args.ks) + f" {'ms/query':>9}")
+    for method, ranked in rankings.items():
+        recalls = [
+            np.mean([candidate in set(owners[ranking[:k]]) for ranking, (_, candidate) in zip(ranked, queries)])
+            for k in args.ks
+        ]
+        print(f"{method:<8} " + " ".join(f"{recall:>7.3f}" for recall in recalls)
+              + f" {seconds[method] / len(queries) * 1000:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
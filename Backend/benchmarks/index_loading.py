@@ -0,0 +1,86 @@
+"""Compare FAISS.load_local with memory-mapped loading across several worker processes.
+
+Run from Backend/:
+
+    python -m benchmarks.index_loading --vectors 200000 --workers 4
+
+Builds a synthetic 768-dim flat index, then starts --workers processes per mode that each
+open it and run one search. Reports time-to-first-search plus RSS and private (USS)
+memory per worker: with mmap the index pages are shared page cache, not private copies,
+and the SQLite docstore is read lazily instead of unpickled whole.
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+import psutil
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import FakeEmbeddings
+
+from index_store import load_faiss, save_faiss
+
+DIMENSIONS = 768
+
+
+def build(path: str, vectors: int) -> None:
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((vectors, DIMENSIONS), dtype=np.float32)
+    texts = [f"chunk {i}" for i in range(vectors)]
+    store = FAISS.from_embeddings(list(zip(texts, embeddings.tolist())), FakeEmbeddings(size=DIMENSIONS))
+    # Both layouts side by side: index.pkl for load_local, docstore.sqlite for load_faiss.
+    store.save_local(path)
+    save_faiss(store, path)
+
+
+def worker(mode: str, path: str, ready, results) -> None:
+    process = psutil.Process()
+    embeddings = FakeEmbeddings(size=DIMENSIONS)
+    start = time.perf_counter()
+    if mode == "mmap":
+        store = load_faiss(path, embeddings)
+    else:
+        store = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    store.similarity_search_with_score_by_vector(np.ones(DIMENSIONS).tolist(), k=5)
+    elapsed = time.perf_counter() - start
+    memory = process.memory_full_info()
+    results.put((elapsed, memory.rss, memory.uss))
+    ready.wait()  # keep every worker alive until all have been measured
+
+
+def run(mode: str, path: str, workers: int):
+    context = multiprocessing.get_context("spawn")
+    ready, results = context.Event(), context.Queue()
+    processes = [context.Process(target=worker, args=(mode, path, ready, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    samples = [results.get() for _ in processes]
+    ready.set()
+    for process in processes:
+        process.join()
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=200000)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        build(path, args.vectors)
+        size_mb = os.path.getsize(os.path.join(path, "index.faiss")) / 2**20
+        print(f"{args.vectors} vectors, index.faiss {size_mb:.0f} MB, {args.workers} workers")
+        print(f"{'mode':<11} {'first search s':>15} {'RSS MB/worker':>14} {'USS MB/worker':>14}")
+        for mode in ("load_local", "mmap"):
+            samples = run(mode, path, args.workers)
+            elapsed = np.mean([s[0] for s in samples])
+            rss = np.mean([s[1] for s in samples]) / 2**20
+            uss = np.mean([s[2] for s in samples]) / 2**20
+            print(f"{mode:<11} {elapsed:>15.3f} {rss:>14.0f} {uss:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
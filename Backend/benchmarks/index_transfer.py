@@ -0,0 +1,88 @@
+"""Bytes and time to push and pull an index: loose per-file layout vs the packed bundle.
+
+Run from Backend/:
+
+    python -m benchmarks.index_transfer --vectors 20000
+    python -m benchmarks.index_transfer --bucket my-bucket --endpoint-url http://localhost:9000
+
+Builds a synthetic 768-dim index of --vectors chunks, pushes it with TieredIndexStore in
+each layout and pulls it back into an empty local store. "files" is the per-file layout
+(one object per snapshot file plus checksums.json); "bundle" rows pack everything into
+one compressed object with float32, float16 or int8 vector payloads. Recall@k compares
+the restored index against exact search over the original vectors, so it shows what the
+lossy encodings cost. Without --bucket the objects go to a local folder, which measures
+bytes and CPU (compression, encoding) but not network time.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import FakeEmbeddings
+
+from benchmarks.corpus import mixed_chunks
+from benchmarks.index_types import DIMENSIONS, clustered_corpus
+from index_builder import exact_neighbors, recall_at_k
+from index_store import IndexStore
+from object_storage import LocalStorage, S3Storage, s3_client
+from tiered_store import TieredIndexStore
+
+USER, DOCUMENT = "benchmark", "transfer.pdf"
+LAYOUTS = [("files", None), ("bundle", "float32"), ("bundle", "float16"), ("bundle", "int8")]
+
+
+def remote_bytes(storage, prefix: str) -> int:
+    if isinstance(storage, LocalStorage):
+        return sum(os.path.getsize(storage._path(key)) for key in storage.list_keys(prefix))
+    pages = storage.client.get_paginator("list_objects_v2").paginate(Bucket=storage.bucket_name, Prefix=prefix)
+    return sum(obj["Size"] for page in pages for obj in page.get("Contents", []))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--bucket", help="S3 bucket to transfer through instead of a local folder")
+    parser.add_argument("--endpoint-url", help="S3-compatible endpoint for --bucket")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors, queries = clustered_corpus(args.vectors, args.queries, max(10, args.vectors // 2000), rng)
+    truth = exact_neighbors(vectors, queries, args.k)
+    embeddings = FakeEmbeddings(size=DIMENSIONS)
+
+    with tempfile.TemporaryDirectory() as root:
+        source = IndexStore(os.path.join(root, "source"))
+        texts = mixed_chunks(args.vectors)
+        source.save(USER, DOCUMENT, FAISS.from_embeddings(list(zip(texts, vectors.tolist())), embeddings))
+        if args.bucket:
+            storage = S3Storage(args.bucket, client=s3_client(args.endpoint_url))
+        else:
+            storage = LocalStorage(os.path.join(root, "remote"))
+
+        print(f"{args.vectors} vectors, {args.queries} queries, {'s3://' + args.bucket if args.bucket else 'local folder'}")
+        print(f"{'layout':<8} {'vectors':<8} {'MB':>8} {'upload s':>9} {'download s':>11} {'recall@k':>9}")
+        for i, (layout, encoding) in enumerate(LAYOUTS):
+            pusher = TieredIndexStore(source, storage, bundle=layout == "bundle",
+                                      vector_encoding=encoding or "float32")
+            start = time.perf_counter()
+            pusher.push(USER, DOCUMENT)
+            upload = time.perf_counter() - start
+            size = remote_bytes(storage, pusher.remote_prefix(USER, DOCUMENT) + "/")
+
+            target = IndexStore(os.path.join(root, f"target-{i}"))
+            start = time.perf_counter()
+            manifest = TieredIndexStore(target, storage).pull(USER, DOCUMENT)
+            download = time.perf_counter() - start
+            restored = target.load(USER, DOCUMENT, embeddings, manifest)
+            recall = recall_at_k(restored.index, queries, truth, args.k)
+            print(f"{layout:<8} {encoding or 'float32':<8} {size / 2**20:>8.1f} {upload:>9.2f} {download:>11.2f} "
+                  f"{recall:>9.3f}")
+        TieredIndexStore(source, storage).delete_remote(USER, DOCUMENT)
+
+
+if __name__ == "__main__":
+    main()
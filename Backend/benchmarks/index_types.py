@@ -0,0 +1,78 @@
+"""Recall@k and query latency of flat, IVF and HNSW indices at several corpus sizes.
+
+Run from Backend/:
+
+    python -m benchmarks.index_types --sizes 10000 100000 500000 --k 10
+
+Vectors are drawn from a normalised Gaussian mixture (embeddings of real documents cluster
+by topic); queries are held-out draws from the same mixture, slightly perturbed. Each approximate index is swept over its query-time parameter and compared with
+exact search; the row marked * is what index_builder.build_index picks for that size.
+"""
+import argparse
+import time
+from typing import Tuple
+
+import faiss
+import numpy as np
+
+from index_builder import build_index, choose_index_kind, exact_neighbors, recall_at_k, set_search_params
+
+DIMENSIONS = 768
+
+
+def clustered_vectors(n: int, clusters: int, rng: np.random.Generator) -> np.ndarray:
+    centres = rng.standard_normal((clusters, DIMENSIONS), dtype=np.float32)
+    vectors = centres[rng.integers(0, clusters, n)] + 0.6 * rng.standard_normal((n, DIMENSIONS), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def clustered_corpus(n: int, queries: int, clusters: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+    """`n` corpus vectors and `queries` query vectors around the same cluster centres.
+
+    Queries are extra rows of the mixture, kept out of the corpus and perturbed a little, so
+    they fall where the corpus is, as real questions about its documents do.
+    """
+    vectors = clustered_vectors(n + queries, clusters, rng)
+    held_out = vectors[n:] + 0.2 * rng.standard_normal((queries, DIMENSIONS), dtype=np.float32) / np.sqrt(DIMENSIONS)
+    return vectors[:n], held_out / np.linalg.norm(held_out, axis=1, keepdims=True)
+
+
+def latency_ms(index: faiss.Index, queries: np.ndarray, k: int) -> float:
+    start = time.perf_counter()
+    for query in queries:
+        index.search(query[None, :], k)
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 300000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'vectors':>8} {'index':<6} {'param':<14} {'build s':>8} {'recall@k':>9} {'ms/query':>9} {'MB':>7}")
+    for n in args.sizes:
+        vectors, queries = clustered_corpus(n, args.queries, max(10, n // 2000), rng)
+        truth = exact_neighbors(vectors, queries, args.k)
+        chosen = choose_index_kind(n)
+        for kind, param, values in (("flat", None, [None]),
+                                    ("ivf", "nprobe", [1, 4, 16, 64]),
+                                    ("hnsw", "ef_search", [16, 64, 256])):
+            index, config = build_index(vectors, kind=kind)
+            size_mb = faiss.serialize_index(index).nbytes / 2**20
+            if param:
+                values = sorted(set(values) | {config[param]})  # include the tuned setting
+            for value in values:
+                if param:
+                    set_search_params(index, {**config, param: value})
+                recall = recall_at_k(index, queries, truth, args.k)
+                label = f"{param}={value}" if param else "exact"
+                marker = "*" if kind == chosen and (not param or value == config.get(param)) else " "
+                print(f"{n:>8} {kind:<6} {label:<14} {config['build_seconds']:>8.2f} {recall:>9.3f} "
+                      f"{latency_ms(index, queries, args.k):>9.3f} {size_mb:>7.0f}{marker}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Benchmark length-bucketed ingestion embedding against document-order encoding.
+
+Run from Backend/:
+
+    python -m benchmarks.ingestion_batching --chunks 2000 --backend onnx
+
+The corpus is the PDFs in uploads/ if any, otherwise a synthetic resume/report mix of
+one-line titles, skill lists and up to 1000-character narrative chunks.
+"""
+import argparse
+import time
+
+from benchmarks.corpus import mixed_chunks, uploaded_chunks
+from embedding_batching import BucketedEmbeddings
+from embeddings import EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME, registry
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--backend", default=EMBEDDING_BACKEND)
+    parser.add_argument("--batch-size", type=int, default=32, help="fixed batch size of the baseline")
+    args = parser.parse_args()
+
+    texts = uploaded_chunks() + mixed_chunks(args.chunks)
+    texts = texts[:args.chunks]
+    model = registry.get(EMBEDDING_MODEL_NAME, args.backend)
+    model.model.embed_documents(texts[:8])
+
+    start = time.perf_counter()
+    for offset in range(0, len(texts), args.batch_size):
+        model.embed_documents(texts[offset:offset + args.batch_size])
+    baseline = len(texts) / (time.perf_counter() - start)
+
+    bucketed = BucketedEmbeddings(model)
+    start = time.perf_counter()
+    bucketed.embed_documents(texts)
+    optimised = len(texts) / (time.perf_counter() - start)
+
+    print(f"{len(texts)} chunks, {args.backend} backend")
+    print(f"document order, batch {args.batch_size}: {baseline:8.1f} chunks/s")
+    print(f"length-bucketed, auto batch:   {optimised:8.1f} chunks/s  ({optimised / baseline:.2f}x)")
+    print(f"auto batch sizes used: {sorted(set(bucketed.batch_sizes), reverse=True)}")
+
+
+if __name__ == "__main__":
+    main()
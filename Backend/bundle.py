@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import shutil
+import struct
+import zlib
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from index_store import DELTA_FILE, MANIFEST_FILE, VECTORS_FILE
+
+# One object per index snapshot: a fixed prefix (magic, header length), a JSON header with the
+# manifest and every section's offset, size and SHA-256, then the zlib-compressed sections.
+BUNDLE_FILE = "index.bundle"
+BUNDLE_MAGIC = b"RAGBNDL1"
+BUNDLE_PREFIX = struct.Struct("<8sQ")
+# First read of a bundle; covers the prefix and header of typical indices in one ranged GET.
+BUNDLE_HEADER_PREFETCH_BYTES = int(os.getenv("BUNDLE_HEADER_PREFETCH_BYTES", str(64 * 1024)))
+BUNDLE_COMPRESSION_LEVEL = int(os.getenv("BUNDLE_COMPRESSION_LEVEL", "6"))
+# Payload of the float vectors (flat index, vectors.npy, append log): float32 keeps them exact,
+# float16 halves and int8 quarters them at a small cost in distance precision.
+VECTOR_ENCODINGS = ("float32", "float16", "int8")
+BUNDLE_VECTOR_ENCODING = os.getenv("BUNDLE_VECTOR_ENCODING", "float32")
+CHUNK_BYTES = 1024 * 1024
+
+
+def encode_vectors(vectors: np.ndarray, encoding: str) -> bytes:
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if encoding == "float16":
+        return vectors.astype(np.float16).tobytes()
+    if encoding == "int8":
+        # Per-dimension affine codes: x ~ low + code * step, with codes 0..255.
+        low = vectors.min(axis=0) if len(vectors) else np.zeros(vectors.shape[1], dtype=np.float32)
+        step = (vectors.max(axis=0) - low) / 255 if len(vectors) else np.ones_like(low)
+        step[step == 0] = 1
+        codes = np.rint((vectors - low) / step).astype(np.uint8)
+        return low.astype(np.float32).tobytes() + step.astype(np.float32).tobytes() + codes.tobytes()
+    return vectors.tobytes()
+
+
+def decode_vectors(data: bytes, encoding: str, rows: int, dimensions: int) -> np.ndarray:
+    if encoding == "float16":
+        return np.frombuffer(data, dtype=np.float16).reshape(rows, dimensions).astype(np.float32)
+    if encoding == "int8":
+        low = np.frombuffer(data, dtype=np.float32, count=dimensions)
+        step = np.frombuffer(data, dtype=np.float32, count=dimensions, offset=4 * dimensions)
+        codes = np.frombuffer(data, dtype=np.uint8, offset=8 * dimensions).reshape(rows, dimensions)
+        return (low + codes * step).astype(np.float32)
+    return np.frombuffer(data, dtype=np.float32).reshape(rows, dimensions).copy()
+
+
+def file_vectors(folder: str, name: str, manifest: Dict) -> Optional[Tuple[np.ndarray, Dict]]:
+    """The float vectors a snapshot file holds, with what's needed to write it back; None for other files."""
+    path = os.path.join(folder, name)
+    if name == VECTORS_FILE:
+        return np.load(path), {"container": "npy"}
+    if name == DELTA_FILE:
+        dimensions = manifest["dimensions"]
+        return np.fromfile(path, dtype=np.float32).reshape(-1, dimensions), {"container": "raw"}
+    if name == "index.faiss" and manifest.get("index", {}).get("kind", "flat") == "flat":
+        index = faiss.read_index(path)
+        if isinstance(index, faiss.IndexFlat):
+            return index.reconstruct_n(0, index.ntotal), {"container": "faiss_flat", "metric": index.metric_type}
+    return None
+
+
+def write_vectors(path: str, vectors: np.ndarray, entry: Dict) -> None:
+    if entry["container"] == "npy":
+        np.save(path, vectors)
+    elif entry["container"] == "raw":
+        vectors.tofile(path)
+    else:
+        index = faiss.IndexFlat(vectors.shape[1], entry["metric"])
+        index.add(vectors)
+        faiss.write_index(index, path)
+
+
+def _compressed(chunks: Iterable[bytes], level: int) -> Iterator[bytes]:
+    compressor = zlib.compressobj(level)
+    for chunk in chunks:
+        yield compressor.compress(chunk)
+    yield compressor.flush()
+
+
+def _compress(chunks: Iterable[bytes], out, level: int) -> Tuple[int, str]:
+    """Write `chunks` zlib-compressed to `out` as they come; returns (bytes written, their SHA-256)."""
+    digest = hashlib.sha256()
+    length = 0
+    for data in _compressed(chunks, level):
+        out.write(data)
+        digest.update(data)
+        length += len(data)
+    return length, digest.hexdigest()
+
+
+def _read_chunks(f, size: int) -> Iterator[bytes]:
+    while size > 0:
+        chunk = f.read(min(CHUNK_BYTES, size))
+        if not chunk:
+            raise IOError("Index bundle is truncated")
+        size -= len(chunk)
+        yield chunk
+
+
+def write_bundle(folder: str, path: str, encoding: str = BUNDLE_VECTOR_ENCODING,
+                 level: int = BUNDLE_COMPRESSION_LEVEL) -> Dict:
+    """Pack the snapshot folder `folder` into the bundle file `path`; returns its header."""
+    if encoding not in VECTOR_ENCODINGS:
+        raise ValueError(f"Unknown vector encoding {encoding!r}; use one of {', '.join(VECTOR_ENCODINGS)}")
+    with open(os.path.join(folder, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    entries = []
+    payload_path = f"{path}.payload"
+    try:
+        with open(payload_path, "wb") as payload:
+            for name in sorted(os.listdir(folder)):
+                source = os.path.join(folder, name)
+                if name.endswith(".tmp") or not os.path.isfile(source):
+                    continue
+                entry = {"name": name, "offset": payload.tell(), "size": os.path.getsize(source), "encoding": "bytes"}
+                vectors = file_vectors(folder, name, manifest) if encoding != "float32" else None
+                if vectors is not None:
+                    array, extra = vectors
+                    entry.update(extra, encoding=encoding, rows=len(array), dimensions=array.shape[1])
+                    entry["length"], entry["sha256"] = _compress([encode_vectors(array, encoding)], payload, level)
+                else:
+                    with open(source, "rb") as f:
+                        entry["length"], entry["sha256"] = _compress(iter(lambda: f.read(CHUNK_BYTES), b""),
+                                                                     payload, level)
+                entries.append(entry)
+        header = json.dumps({"manifest": manifest, "entries": entries}).encode()
+        with open(path, "wb") as f:
+            f.write(BUNDLE_PREFIX.pack(BUNDLE_MAGIC, len(header)))
+            f.write(header)
+            with open(payload_path, "rb") as payload:
+                shutil.copyfileobj(payload, f, CHUNK_BYTES)
+    finally:
+        if os.path.exists(payload_path):
+            os.remove(payload_path)
+    return json.loads(header)
+
+
+def read_header(read_range: Callable[[int, int], bytes]) -> Tuple[Dict, int]:
+    """A bundle's header and the offset its sections start at.
+
+    `read_range(start, length)` reads bytes of the bundle, e.g. with a ranged GET; it is called
+    once unless the header is larger than BUNDLE_HEADER_PREFETCH_BYTES.
+    """
+    head = read_range(0, BUNDLE_HEADER_PREFETCH_BYTES)
+    if len(head) < BUNDLE_PREFIX.size:
+        raise IOError("Index bundle is truncated")
+    magic, length = BUNDLE_PREFIX.unpack_from(head)
+    if magic != BUNDLE_MAGIC:
+        raise IOError("Not an index bundle")
+    end = BUNDLE_PREFIX.size + length
+    if len(head) < end:
+        head += read_range(len(head), end - len(head))
+    return json.loads(head[BUNDLE_PREFIX.size:end]), end
+
+
+def extract_bundle(path: str, folder: str) -> Dict:
+    """Unpack the bundle file `path` into `folder`, verifying every section; returns the header."""
+    with open(path, "rb") as f:
+        def read_range(start: int, length: int) -> bytes:
+            f.seek(start)
+            return f.read(length)
+
+        header, start = read_header(read_range)
+        for entry in header["entries"]:
+            f.seek(start + entry["offset"])
+            decompressor = zlib.decompressobj()
+            digest = hashlib.sha256()
+            target = os.path.join(folder, entry["name"])
+            # Vector sections are decoded whole: they are re-encoded as one array (and were
+            # read into memory to encode them in write_bundle). Other sections stream to disk.
+            decoded = []
+            with open(target, "wb") if entry["encoding"] == "bytes" else open(os.devnull, "wb") as out:
+                try:
+                    for chunk in _read_chunks(f, entry["length"]):
+                        digest.update(chunk)
+                        data = decompressor.decompress(chunk)
+                        if entry["encoding"] == "bytes":
+                            out.write(data)
+                        else:
+                            decoded.append(data)
+                    tail = decompressor.flush()
+                except zlib.error as e:
+                    # Corruption usually breaks the stream before the checksum can be compared.
+                    raise IOError(f"Corrupt section {entry['name']} in index bundle: {str(e)}")
+                if entry["encoding"] == "bytes":
+                    out.write(tail)
+                else:
+                    decoded.append(tail)
+            if digest.hexdigest() != entry["sha256"]:
+                raise IOError(f"Checksum mismatch for {entry['name']} in index bundle")
+            if entry["encoding"] != "bytes":
+                vectors = decode_vectors(b"".join(decoded), entry["encoding"], entry["rows"], entry["dimensions"])
+                write_vectors(target, vectors, entry)
+    return header
@@ -0,0 +1,139 @@
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from typing import Dict, Iterator, List, Mapping, Tuple, Union
+
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+DOCSTORE_FILE = "docstore.sqlite"
+# zlib-compress chunk text on disk; chunks are ~1 KB of prose, which typically shrinks 2-3x.
+DOCSTORE_COMPRESS = os.getenv("DOCSTORE_COMPRESS", "1") == "1"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    position INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    content BLOB NOT NULL,
+    compressed INTEGER NOT NULL,
+    metadata TEXT NOT NULL
+)
+"""
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """Chunk text and metadata in an indexed SQLite file, read one search hit at a time.
+
+    Rows are keyed both by docstore id and by FAISS position, so loading an index costs the
+    same however many chunks it holds; only the top-k hits of a query are ever fetched.
+    """
+
+    def __init__(self, path: str, compress: bool = DOCSTORE_COMPRESS, read_only: bool = True):
+        self.path = path
+        self.compress = compress
+        self.read_only = read_only
+        self._local = threading.local()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared across threads; /ask runs on a thread pool.
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            if self.read_only:
+                connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            else:
+                connection = sqlite3.connect(self.path)
+                connection.execute(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def _encode(self, text: str) -> bytes:
+        data = text.encode("utf-8")
+        return zlib.compress(data) if self.compress else data
+
+    @staticmethod
+    def _decode(content: bytes, compressed: int) -> str:
+        return (zlib.decompress(content) if compressed else content).decode("utf-8")
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        """Append documents; FAISS positions continue after the existing rows."""
+        with self.connection as connection:
+            start = connection.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM chunks").fetchone()[0]
+            self.add_at({start + i: (doc_id, doc) for i, (doc_id, doc) in enumerate(texts.items())})
+
+    def add_at(self, rows: Dict[int, tuple]) -> None:
+        """Insert {faiss position: (docstore id, Document)} rows."""
+        with self.connection as connection:
+            connection.executemany(
+                "INSERT INTO chunks (position, id, content, compressed, metadata) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (position, doc_id, self._encode(doc.page_content), int(self.compress), json.dumps(doc.metadata))
+                    for position, (doc_id, doc) in rows.items()
+                ],
+            )
+
+    def search(self, search: str) -> Union[str, Document]:
+        row = self.connection.execute(
+            "SELECT content, compressed, metadata FROM chunks WHERE id = ?", (search,)
+        ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        content, compressed, metadata = row
+        return Document(id=search, page_content=self._decode(content, compressed), metadata=json.loads(metadata))
+
+    def rows(self) -> Iterator[Tuple[int, str, Document]]:
+        """All (position, docstore id, Document) rows in position order."""
+        rows = self.connection.execute(
+            "SELECT position, id, content, compressed, metadata FROM chunks ORDER BY position"
+        )
+        for position, doc_id, content, compressed, metadata in rows:
+            yield position, doc_id, Document(id=doc_id, page_content=self._decode(content, compressed),
+                                             metadata=json.loads(metadata))
+
+    def id_at(self, position: int) -> str:
+        row = self.connection.execute("SELECT id FROM chunks WHERE position = ?", (position,)).fetchone()
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def delete(self, ids: List) -> None:
+        with self.connection as connection:
+            connection.executemany("DELETE FROM chunks WHERE id = ?", [(doc_id,) for doc_id in ids])
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def close(self) -> None:
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+class PositionIdMap(Mapping):
+    """Lazy `index_to_docstore_id` for the FAISS wrapper, backed by the docstore's position column."""
+
+    def __init__(self, docstore: SQLiteDocstore):
+        self.docstore = docstore
+
+    def __getitem__(self, position: int) -> str:
+        return self.docstore.id_at(int(position))
+
+    def __len__(self) -> int:
+        return len(self.docstore)
+
+    def __iter__(self) -> Iterator[int]:
+        for (position,) in self.docstore.connection.execute("SELECT position FROM chunks ORDER BY position"):
+            yield position
+
+
+def write_docstore(path: str, docstore: Docstore, index_to_docstore_id: Dict[int, str],
+                   compress: bool = DOCSTORE_COMPRESS) -> None:
+    """Persist an in-memory docstore (as built by FAISS.from_documents) to a new SQLite file."""
+    store = SQLiteDocstore(path, compress=compress, read_only=False)
+    try:
+        store.add_at({position: (doc_id, docstore.search(doc_id)) for position, doc_id in index_to_docstore_id.items()})
+    finally:
+        store.close()
@@ -0,0 +1,303 @@
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import psutil
+from langchain_core.embeddings import Embeddings
+
+from embeddings import (
+    EMBEDDING_BACKEND,
+    EMBEDDING_MAX_BATCH_SIZE,
+    EMBEDDING_MODEL_NAME,
+    InstrumentedEmbeddings,
+    configure_threads,
+    get_embeddings,
+)
+from metrics import LatencyStats
+
+QUERY_BATCH_WINDOW_MS = float(os.getenv("QUERY_BATCH_WINDOW_MS", "5"))
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "32"))
+# Width of a token-length bucket, and the share of free memory one ingestion batch may use.
+EMBEDDING_BUCKET_WIDTH = int(os.getenv("EMBEDDING_BUCKET_WIDTH", "32"))
+EMBEDDING_BATCH_MEMORY_FRACTION = float(os.getenv("EMBEDDING_BATCH_MEMORY_FRACTION", "0.1"))
+# Number of embedding worker processes (0 disables the pool) and the smallest chunk list worth sharding.
+EMBEDDING_POOL_WORKERS = int(os.getenv("EMBEDDING_POOL_WORKERS", "0"))
+EMBEDDING_POOL_MIN_CHUNKS = int(os.getenv("EMBEDDING_POOL_MIN_CHUNKS", "256"))
+
+
+class QueryBatcher:
+    """Coalesces concurrent query embeddings into a single forward pass.
+
+    Callers block in `embed_query` while a background thread collects questions for up to
+    `window_ms` after the first one arrives (or until `max_batch_size` are queued), encodes
+    them together and hands each caller its own vector.
+    """
+
+    def __init__(self, embeddings: InstrumentedEmbeddings, window_ms: float = QUERY_BATCH_WINDOW_MS,
+                 max_batch_size: int = QUERY_BATCH_MAX_SIZE):
+        self.embeddings = embeddings
+        self.window_seconds = window_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self.queue_delay = LatencyStats()
+        self.batch_encode = LatencyStats()
+        self._queue: "queue.Queue[Tuple[str, float, Future]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self) -> None:
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+                    self._thread.start()
+
+    def embed_query(self, text: str) -> List[float]:
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((text, time.perf_counter(), future))
+        return future.result()
+
+    def _collect(self) -> List[Tuple[str, float, Future]]:
+        first = self._queue.get()
+        batch = [first]
+        deadline = first[1] + self.window_seconds
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            for _, enqueued, _ in batch:
+                self.queue_delay.record(started - enqueued)
+            try:
+                with self.batch_encode.time(items=len(batch)):
+                    vectors = self.embeddings.embed_queries([text for text, _, _ in batch])
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, _, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+    def stats(self) -> Dict[str, object]:
+        encode = self.batch_encode.snapshot()
+        return {
+            "window_ms": self.window_seconds * 1000.0,
+            "max_batch_size": self.max_batch_size,
+            "mean_batch_size": round(encode["items"] / encode["calls"], 2) if encode["calls"] else 0.0,
+            "queue_delay": self.queue_delay.snapshot(),
+            "batch_encode": encode,
+        }
+
+
+def auto_batch_size(sequence_length: int, hidden_size: int = 768, num_heads: int = 12,
+                    memory_fraction: float = EMBEDDING_BATCH_MEMORY_FRACTION,
+                    max_batch_size: int = EMBEDDING_MAX_BATCH_SIZE) -> int:
+    """Largest batch of `sequence_length`-token inputs whose activations fit the memory budget.
+
+    Inference keeps roughly one layer of activations alive at a time: the hidden states and
+    feed-forward intermediates (~8 x hidden per token) plus the attention score matrices
+    (heads x length^2), all float32, doubled for allocator slack.
+    """
+    per_sequence = 4 * (sequence_length * hidden_size * 8 + num_heads * sequence_length ** 2) * 2
+    budget = psutil.virtual_memory().available * memory_fraction
+    return int(max(1, min(max_batch_size, budget // per_sequence)))
+
+
+class BucketedEmbeddings(Embeddings):
+    """Encodes documents in token-length buckets with memory-sized batches.
+
+    Chunks are sorted by token count so each forward pass pads to a similar length, then
+    the vectors are put back in the caller's order.
+    """
+
+    def __init__(self, embeddings: InstrumentedEmbeddings, bucket_width: int = EMBEDDING_BUCKET_WIDTH):
+        self.embeddings = embeddings
+        self.bucket_width = max(1, bucket_width)
+        self.batch_sizes: List[int] = []
+
+    def token_lengths(self, texts: List[str]) -> np.ndarray:
+        # Counted as the model sees them: anything past its window is truncated before encoding.
+        encoded = self.embeddings.tokenizer(texts, add_special_tokens=True, truncation=True,
+                                            max_length=self.embeddings.max_seq_length)
+        return np.array([len(ids) for ids in encoded["input_ids"]])
+
+    def batches(self, texts: List[str]) -> List[List[int]]:
+        """Group text indices into batches of similar token length."""
+        lengths = self.token_lengths(texts)
+        order = np.argsort(lengths, kind="stable")
+        batches: List[List[int]] = []
+        current: List[int] = []
+        current_bucket = None
+        batch_size = 0
+        for index in order:
+            bucket = int(lengths[index]) // self.bucket_width
+            if bucket != current_bucket or len(current) >= batch_size:
+                if current:
+                    batches.append(current)
+                current = []
+                current_bucket = bucket
+                batch_size = auto_batch_size((bucket + 1) * self.bucket_width)
+            current.append(int(index))
+        if current:
+            batches.append(current)
+        return batches
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        for batch in self.batches(texts):
+            self.batch_sizes.append(len(batch))
+            for index, vector in zip(batch, self.embeddings.embed_documents([texts[i] for i in batch])):
+                vectors[index] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+
+def _init_pool_worker(model_name: str, backend: str, threads: int) -> None:
+    # Split the cores between workers instead of letting each one oversubscribe all of them.
+    configure_threads(threads)
+    get_embeddings(model_name, backend)
+
+
+def _embed_shard(model_name: str, backend: str, texts: List[str]) -> Tuple[int, float, np.ndarray]:
+    start = time.perf_counter()
+    vectors = BucketedEmbeddings(get_embeddings(model_name, backend)).embed_documents(texts)
+    return os.getpid(), time.perf_counter() - start, np.asarray(vectors, dtype=np.float32)
+
+
+class EmbeddingPool:
+    """Worker processes that each hold the embedding model once and embed shards of a chunk list."""
+
+    def __init__(self, workers: int, model_name: str = EMBEDDING_MODEL_NAME, backend: str = EMBEDDING_BACKEND,
+                 shards_per_worker: int = 4):
+        self.workers = workers
+        self.model_name = model_name
+        self.backend = backend
+        # A few shards per worker evens out workers that drew longer chunks.
+        self.shards_per_worker = shards_per_worker
+        threads = max(1, (os.cpu_count() or workers) // workers)
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_pool_worker,
+            initargs=(model_name, backend, threads),
+        )
+        self._stats_lock = threading.Lock()
+        self.worker_stats: Dict[int, LatencyStats] = {}
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        shard_size = math.ceil(len(texts) / (self.workers * self.shards_per_worker))
+        futures = [
+            self._executor.submit(_embed_shard, self.model_name, self.backend, texts[start:start + shard_size])
+            for start in range(0, len(texts), shard_size)
+        ]
+        shards = []
+        for future in futures:
+            pid, seconds, vectors = future.result()
+            with self._stats_lock:
+                stats = self.worker_stats.setdefault(pid, LatencyStats())
+            stats.record(seconds, items=len(vectors))
+            shards.append(vectors)
+        return np.vstack(shards).tolist()
+
+    def warm(self) -> None:
+        """Start every worker process and load its model before the first real job."""
+        futures = [
+            self._executor.submit(_embed_shard, self.model_name, self.backend, ["warm up"])
+            for _ in range(self.workers)
+        ]
+        for future in futures:
+            future.result()
+
+    def stats(self) -> Dict[str, object]:
+        with self._stats_lock:
+            workers = dict(self.worker_stats)
+        return {"workers": self.workers, "per_worker": {str(pid): stats.snapshot() for pid, stats in workers.items()}}
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+class PooledEmbeddings(Embeddings):
+    """Sends large chunk lists to the embedding pool and embeds small ones in-process."""
+
+    def __init__(self, embeddings: InstrumentedEmbeddings, pool: EmbeddingPool,
+                 min_chunks: int = EMBEDDING_POOL_MIN_CHUNKS):
+        self.local = BucketedEmbeddings(embeddings)
+        self.pool = pool
+        self.min_chunks = min_chunks
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if len(texts) < self.min_chunks:
+            return self.local.embed_documents(texts)
+        return self.pool.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.local.embed_query(text)
+
+
+_embedding_pool: Optional[EmbeddingPool] = None
+_embedding_pool_lock = threading.Lock()
+
+
+def get_embedding_pool() -> Optional[EmbeddingPool]:
+    """Return the process-wide embedding pool, or None when EMBEDDING_POOL_WORKERS is 0.
+
+    Worker processes start lazily; call `EmbeddingPool.warm` to start them up front.
+    """
+    global _embedding_pool
+    if EMBEDDING_POOL_WORKERS <= 0:
+        return None
+    if _embedding_pool is None:
+        with _embedding_pool_lock:
+            if _embedding_pool is None:
+                _embedding_pool = EmbeddingPool(EMBEDDING_POOL_WORKERS)
+    return _embedding_pool
+
+
+def shutdown_embedding_pool() -> None:
+    global _embedding_pool
+    with _embedding_pool_lock:
+        if _embedding_pool is not None:
+            _embedding_pool.shutdown()
+            _embedding_pool = None
+
+
+def ingestion_embeddings(embeddings: InstrumentedEmbeddings) -> Embeddings:
+    """Embeddings to use for bulk document ingestion: pooled when enabled, else bucketed in-process."""
+    pool = get_embedding_pool()
+    if pool is None:
+        return BucketedEmbeddings(embeddings)
+    return PooledEmbeddings(embeddings, pool)
+
+
+_query_batcher: Optional[QueryBatcher] = None
+_query_batcher_lock = threading.Lock()
+
+
+def get_query_batcher() -> QueryBatcher:
+    """Return the process-wide query batcher in front of the shared embedding model."""
+    global _query_batcher
+    if _query_batcher is None:
+        with _query_batcher_lock:
+            if _query_batcher is None:
+                _query_batcher = QueryBatcher(get_embeddings())
+    return _query_batcher
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import diskcache
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache")
+EMBEDDING_CACHE_SIZE_BYTES = int(os.getenv("EMBEDDING_CACHE_SIZE_BYTES", str(2 * 1024 ** 3)))
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+
+_disk_cache: Optional[diskcache.Cache] = None
+_disk_cache_lock = threading.Lock()
+
+
+def get_disk_cache() -> diskcache.Cache:
+    """Return the process-wide chunk embedding cache, opening it on first use."""
+    global _disk_cache
+    if _disk_cache is None:
+        with _disk_cache_lock:
+            if _disk_cache is None:
+                _disk_cache = diskcache.Cache(
+                    EMBEDDING_CACHE_DIR,
+                    size_limit=EMBEDDING_CACHE_SIZE_BYTES,
+                    eviction_policy="least-recently-used",
+                )
+    return _disk_cache
+
+
+def normalize_chunk_text(text: str) -> str:
+    """Canonical form of a chunk for hashing: NFC unicode with collapsed whitespace."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def chunk_cache_key(model_id: str, text: str) -> str:
+    digest = hashlib.sha256(normalize_chunk_text(text).encode("utf-8")).hexdigest()
+    return f"{model_id}:{digest}"
+
+
+class CachedEmbeddings(Embeddings):
+    """Content-hash disk cache in front of a model's document encoder.
+
+    Create one per upload: `stats()` reports the hit rate of that upload only.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_id: str, cache: Optional[diskcache.Cache] = None):
+        self.embeddings = embeddings
+        # model_id includes the backend: backends produce slightly different vectors.
+        self.model_id = model_id
+        self.cache = cache if cache is not None else get_disk_cache()
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        missing: Dict[str, List[int]] = {}
+        for i, text in enumerate(texts):
+            key = chunk_cache_key(self.model_id, text)
+            if key in missing:
+                # Same chunk repeated within this batch: encode it once.
+                missing[key].append(i)
+                continue
+            cached = self.cache.get(key)
+            if cached is None:
+                missing[key] = [i]
+            else:
+                vectors[i] = np.frombuffer(cached, dtype=np.float32).tolist()
+
+        if missing:
+            computed = self.embeddings.embed_documents([texts[indices[0]] for indices in missing.values()])
+            for (key, indices), vector in zip(missing.items(), computed):
+                self.cache.set(key, np.asarray(vector, dtype=np.float32).tobytes())
+                for i in indices:
+                    vectors[i] = vector
+
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def normalize_question(question: str) -> str:
+    """Canonical form of a question: case-folded, whitespace collapsed, trailing punctuation dropped."""
+    text = " ".join(unicodedata.normalize("NFC", question).casefold().split())
+    return text.rstrip(" ?!.,;:")
+
+
+class QueryEmbeddingCache:
+    """Thread-safe in-memory LRU of question embeddings keyed by model and normalised question."""
+
+    def __init__(self, capacity: int = QUERY_CACHE_SIZE):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_compute(self, model_id: str, question: str, compute: Callable[[str], List[float]]) -> List[float]:
+        key = (model_id, normalize_question(question))
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+            self.misses += 1
+
+        # Encode outside the lock; two threads racing on the same new question both encode it.
+        vector = compute(question)
+        if self.capacity <= 0:
+            return vector
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return vector
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "capacity": self.capacity,
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+query_cache = QueryEmbeddingCache()
@@ -0,0 +1,236 @@
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from filelock import FileLock
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from metrics import LatencyStats
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "sentence-transformers/all-mpnet-base-v2")
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE", "cpu")
+# "torch" (sentence-transformers), "onnx" (fp32 ONNX Runtime) or "onnx-int8" (dynamically quantized)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+ONNX_MODELS_DIR = os.getenv("ONNX_MODELS_DIR", "onnx_models")
+# Upper bound for one forward pass; callers such as BucketedEmbeddings pick smaller batches.
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "256"))
+# Intra-op threads per model; 0 keeps the runtime default (all cores).
+EMBEDDING_INTRA_OP_THREADS = int(os.getenv("EMBEDDING_INTRA_OP_THREADS", "0"))
+
+
+def configure_threads(threads: int) -> None:
+    """Set the intra-op thread count used by models loaded after this call."""
+    global EMBEDDING_INTRA_OP_THREADS
+    EMBEDDING_INTRA_OP_THREADS = threads
+
+
+def export_onnx_model(model_name: str, models_dir: str = ONNX_MODELS_DIR, quantize: bool = False) -> str:
+    """Export `model_name` to ONNX (and optionally int8) once, returning the model path."""
+    target_dir = os.path.join(models_dir, model_name.replace("/", "__"))
+    fp32_path = os.path.join(target_dir, "model.onnx")
+    int8_path = os.path.join(target_dir, "model.int8.onnx")
+    model_path = int8_path if quantize else fp32_path
+    if os.path.exists(model_path):
+        return model_path
+
+    os.makedirs(target_dir, exist_ok=True)
+    # Several uvicorn workers may start at once; only one of them should export.
+    with FileLock(os.path.join(target_dir, "export.lock")):
+        if not os.path.exists(fp32_path):
+            import torch
+            from transformers import AutoModel, AutoTokenizer
+
+            print(f"Exporting {model_name} to ONNX at {fp32_path}...")
+            tokenizer = AutoTokenizer.from_pretrained(model_name)
+            model = AutoModel.from_pretrained(model_name)
+            model.eval()
+            sample = tokenizer(["export sample"], return_tensors="pt")
+            tmp_path = fp32_path + ".tmp"
+            with torch.no_grad():
+                torch.onnx.export(
+                    model,
+                    (sample["input_ids"], sample["attention_mask"]),
+                    tmp_path,
+                    input_names=["input_ids", "attention_mask"],
+                    output_names=["last_hidden_state"],
+                    dynamic_axes={
+                        "input_ids": {0: "batch", 1: "sequence"},
+                        "attention_mask": {0: "batch", 1: "sequence"},
+                        "last_hidden_state": {0: "batch", 1: "sequence"},
+                    },
+                    opset_version=14,
+                )
+            os.replace(tmp_path, fp32_path)
+
+        if quantize and not os.path.exists(int8_path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            print(f"Quantizing {fp32_path} to int8...")
+            tmp_path = int8_path + ".tmp"
+            quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+            os.replace(tmp_path, int8_path)
+    return model_path
+
+
+class OnnxEmbeddings(Embeddings):
+    """Mean-pooled, L2-normalised sentence embeddings computed with ONNX Runtime on CPU."""
+
+    def __init__(self, model_name: str, quantize: bool = False, models_dir: str = ONNX_MODELS_DIR,
+                 batch_size: int = EMBEDDING_MAX_BATCH_SIZE, max_length: int = 384):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        # all-mpnet-base-v2 is trained with a 384 token window, same as sentence-transformers truncates to.
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model_path = export_onnx_model(model_name, models_dir, quantize)
+
+        options = ort.SessionOptions()
+        if EMBEDDING_INTRA_OP_THREADS:
+            options.intra_op_num_threads = EMBEDDING_INTRA_OP_THREADS
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+        self._input_names = {node.name for node in self.session.get_inputs()}
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encoded = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np")
+        inputs = {name: value.astype(np.int64) for name, value in encoded.items() if name in self._input_names}
+        token_embeddings = self.session.run(["last_hidden_state"], inputs)[0]
+
+        mask = encoded["attention_mask"][..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return pooled / np.clip(norms, 1e-12, None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = [
+            self._encode_batch(texts[start:start + self.batch_size])
+            for start in range(0, len(texts), self.batch_size)
+        ]
+        if not vectors:
+            return []
+        return np.vstack(vectors).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode_batch([text])[0].tolist()
+
+
+class InstrumentedEmbeddings(Embeddings):
+    """Wraps a loaded embedding model and records the encode time of every call."""
+
+    def __init__(self, model_name: str, backend: str, model: Embeddings, load_seconds: float):
+        self.model_name = model_name
+        self.backend = backend
+        self.model = model
+        self.load_seconds = load_seconds
+        self.document_stats = LatencyStats()
+        self.query_stats = LatencyStats()
+
+    @property
+    def model_id(self) -> str:
+        return f"{self.model_name}[{self.backend}]"
+
+    @property
+    def tokenizer(self):
+        """The model's HuggingFace tokenizer, whichever backend serves it."""
+        if isinstance(self.model, OnnxEmbeddings):
+            return self.model.tokenizer
+        return self.model._client.tokenizer
+
+    @property
+    def max_seq_length(self) -> int:
+        """Tokens the model reads per input; it truncates longer ones."""
+        if isinstance(self.model, OnnxEmbeddings):
+            return self.model.max_length
+        return self.model._client.max_seq_length
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self.document_stats.time(items=len(texts)):
+            return self.model.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with self.query_stats.time():
+            return self.model.embed_query(text)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Encode several queries in one forward pass, counted as query traffic."""
+        with self.query_stats.time(items=len(texts)):
+            return self.model.embed_documents(texts)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "backend": self.backend,
+            "load_seconds": round(self.load_seconds, 3),
+            "embed_documents": self.document_stats.snapshot(),
+            "embed_query": self.query_stats.snapshot(),
+        }
+
+
+class EmbeddingRegistry:
+    """Loads each embedding model once per process and shares the instance across threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._load_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._models: Dict[Tuple[str, str], InstrumentedEmbeddings] = {}
+
+    def get(self, model_name: str = EMBEDDING_MODEL_NAME, backend: str = EMBEDDING_BACKEND) -> InstrumentedEmbeddings:
+        """Return the shared model, loading it on first use."""
+        key = (model_name, backend)
+        model = self._models.get(key)
+        if model is not None:
+            return model
+
+        # One lock per model so a slow load doesn't block lookups of other models.
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            model = self._models.get(key)
+            if model is None:
+                model = self._load(model_name, backend)
+                self._models[key] = model
+        return model
+
+    def _load(self, model_name: str, backend: str) -> InstrumentedEmbeddings:
+        if backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {EMBEDDING_BACKENDS}")
+
+        print(f"Loading embedding model {model_name} with the {backend} backend...")
+        start = time.perf_counter()
+        if backend == "torch":
+            if EMBEDDING_INTRA_OP_THREADS:
+                import torch
+                torch.set_num_threads(EMBEDDING_INTRA_OP_THREADS)
+            model = HuggingFaceEmbeddings(
+                model_name=model_name,
+                model_kwargs={'device': EMBEDDING_DEVICE},
+                encode_kwargs={'normalize_embeddings': True, 'batch_size': EMBEDDING_MAX_BATCH_SIZE}
+            )
+        else:
+            model = OnnxEmbeddings(model_name, quantize=backend == "onnx-int8")
+        load_seconds = time.perf_counter() - start
+        print(f"Loaded {model_name} in {load_seconds:.2f}s")
+        return InstrumentedEmbeddings(model_name, backend, model, load_seconds)
+
+    def warm(self, model_names: Optional[List[str]] = None) -> None:
+        """Load the given models and run one throwaway encode so the first request is fast."""
+        for model_name in model_names or [EMBEDDING_MODEL_NAME]:
+            # Bypass the instrumented wrapper so warm-up doesn't skew request metrics.
+            self.get(model_name).model.embed_query("warm up")
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        return {f"{name}[{backend}]": model.stats() for (name, backend), model in list(self._models.items())}
+
+
+registry = EmbeddingRegistry()
+
+
+def get_embeddings(model_name: str = EMBEDDING_MODEL_NAME, backend: str = EMBEDDING_BACKEND) -> InstrumentedEmbeddings:
+    """Return the process-wide embedding model for `model_name` on the configured backend."""
+    return registry.get(model_name, backend)
@@ -0,0 +1,260 @@
+import math
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+import faiss
+import numpy as np
+
+# Corpus sizes at which the builder switches from exact search to IVF, and from IVF to HNSW.
+INDEX_FLAT_MAX_VECTORS = int(os.getenv("INDEX_FLAT_MAX_VECTORS", "20000"))
+INDEX_IVF_MAX_VECTORS = int(os.getenv("INDEX_IVF_MAX_VECTORS", "200000"))
+# recall@k (against exact search) that nprobe / efSearch are tuned to reach.
+INDEX_TARGET_RECALL = float(os.getenv("INDEX_TARGET_RECALL", "0.95"))
+# Compressed (product-quantized) mode: bytes per vector code (96 -> 32x smaller than 768 float32),
+# whether to learn an OPQ rotation first, and how many candidates per result to re-rank exactly.
+INDEX_PQ_BYTES = int(os.getenv("INDEX_PQ_BYTES", "96"))
+INDEX_PQ_OPQ = os.getenv("INDEX_PQ_OPQ", "1") == "1"
+INDEX_RERANK_FACTOR = int(os.getenv("INDEX_RERANK_FACTOR", "4"))
+# PQ needs ~39 x 256 training points per codebook; below that compression isn't worth it.
+INDEX_PQ_MIN_VECTORS = int(os.getenv("INDEX_PQ_MIN_VECTORS", "10000"))
+COMPRESSED_KINDS = ("ivfpq", "opq")
+# Binary mode: sign bits scanned by Hamming distance (768 float32 dims -> 96 bytes), with the
+# shortlist re-ranked exactly; the re-rank factor is tuned instead of a probe count.
+INDEX_BINARY_MIN_VECTORS = int(os.getenv("INDEX_BINARY_MIN_VECTORS", "10000"))
+# Kinds whose search goes through RerankIndex and so need vectors.npy at query time.
+RERANKED_KINDS = COMPRESSED_KINDS + ("binary",)
+TUNING_QUERIES = 200
+TUNING_K = 10
+
+
+def choose_index_kind(n_vectors: int, compressed: bool = False, binary: bool = False) -> str:
+    if binary and n_vectors >= INDEX_BINARY_MIN_VECTORS:
+        return "binary"
+    if compressed and n_vectors >= INDEX_PQ_MIN_VECTORS:
+        return "opq" if INDEX_PQ_OPQ else "ivfpq"
+    if n_vectors <= INDEX_FLAT_MAX_VECTORS:
+        return "flat"
+    if n_vectors <= INDEX_IVF_MAX_VECTORS:
+        return "ivf"
+    return "hnsw"
+
+
+def ivf_nlist(n_vectors: int) -> int:
+    # The usual 4*sqrt(n) rule, keeping at least ~39 training points per centroid.
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+
+
+class BinarySignIndex:
+    """Sign bits of float vectors in a faiss.IndexBinaryFlat, scanned by Hamming distance.
+
+    Adds and searches float vectors like a float index, so it can be the first stage of a
+    RerankIndex; its own distances are Hamming distances, not L2.
+    """
+
+    def __init__(self, binary: faiss.IndexBinary):
+        self.binary = binary
+
+    @property
+    def d(self) -> int:
+        return self.binary.d
+
+    @property
+    def ntotal(self) -> int:
+        return self.binary.ntotal
+
+    @staticmethod
+    def pack(vectors: np.ndarray) -> np.ndarray:
+        return np.packbits(np.asarray(vectors) > 0, axis=1)
+
+    def add(self, vectors: np.ndarray) -> None:
+        self.binary.add(self.pack(vectors))
+
+    def search(self, queries: np.ndarray, k: int, params=None):
+        distances, labels = self.binary.search(self.pack(queries), k, params=params)
+        return distances.astype(np.float32), labels
+
+
+def write_index_file(index, path: str) -> None:
+    if isinstance(index, BinarySignIndex):
+        faiss.write_index_binary(index.binary, path)
+    else:
+        faiss.write_index(index, path)
+
+
+def read_index_file(path: str, kind: str, flags: int = 0):
+    if kind == "binary":
+        return BinarySignIndex(faiss.read_index_binary(path, flags))
+    return faiss.read_index(path, flags)
+
+
+class RerankIndex:
+    """Compressed index whose candidates are re-ranked with the exact float vectors.
+
+    Quacks like a faiss index as far as the LangChain FAISS wrapper is concerned (`search`,
+    `d`, `ntotal`). The float vectors are usually a read-only memmap of vectors.npy, so only
+    the shortlisted rows are paged in; rows appended since the last compaction are in `delta`.
+    """
+
+    def __init__(self, base: faiss.Index, vectors: np.ndarray, delta: Optional[np.ndarray] = None,
+                 factor: int = INDEX_RERANK_FACTOR):
+        self.base = base
+        self.vectors = vectors
+        self.delta = delta if delta is not None else np.empty((0, base.d), dtype=np.float32)
+        self.factor = max(1, factor)
+
+    @property
+    def d(self) -> int:
+        return self.base.d
+
+    @property
+    def ntotal(self) -> int:
+        return self.base.ntotal
+
+    def rows(self, ids: np.ndarray) -> np.ndarray:
+        stored = len(self.vectors)
+        if ids.size and ids.max() >= stored:
+            return np.vstack([self.vectors[i] if i < stored else self.delta[i - stored] for i in ids])
+        # Sorted reads keep the memmap access sequential.
+        order = np.argsort(ids)
+        rows = np.empty((len(ids), self.d), dtype=np.float32)
+        rows[order] = self.vectors[ids[order]]
+        return rows
+
+    def search(self, queries: np.ndarray, k: int, params=None):
+        _, candidates = self.base.search(queries, k * self.factor, params=params)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        labels = np.full((len(queries), k), -1, dtype=np.int64)
+        for row, (query, ids) in enumerate(zip(queries, candidates)):
+            ids = ids[ids >= 0]
+            if not ids.size:
+                continue
+            exact = ((self.rows(ids) - query) ** 2).sum(axis=1)
+            best = np.argsort(exact)[:k]
+            distances[row, :len(best)] = exact[best]
+            labels[row, :len(best)] = ids[best]
+        return distances, labels
+
+
+def exact_neighbors(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    return index.search(queries, k)[1]
+
+
+def recall_at_k(index: faiss.Index, queries: np.ndarray, ground_truth: np.ndarray, k: int) -> float:
+    """Share of the exact top-k neighbours that `index` also returns in its top-k."""
+    found = index.search(queries, k)[1]
+    hits = sum(len(set(row[:k]) & set(truth[:k])) for row, truth in zip(found, ground_truth))
+    return hits / float(ground_truth.shape[0] * k)
+
+
+def set_search_params(index: faiss.Index, config: Dict) -> None:
+    """Apply the recorded query-time parameters of `config` to a loaded index."""
+    if isinstance(index, RerankIndex):
+        index.factor = config.get("rerank_factor", index.factor)
+        index = index.base
+    if "nprobe" in config:
+        faiss.extract_index_ivf(index).nprobe = config["nprobe"]
+    if "ef_search" in config:
+        faiss.downcast_index(index).hnsw.efSearch = config["ef_search"]
+
+
+def search_parameters(config: Dict, selector: faiss.IDSelector) -> faiss.SearchParameters:
+    """Search parameters restricting a search to `selector` while keeping the tuned nprobe / efSearch.
+
+    Parameters passed at search time replace the index's own, so they must carry its settings.
+    """
+    if "nprobe" in config:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=config["nprobe"])
+    if "ef_search" in config:
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=config["ef_search"])
+    return faiss.SearchParameters(sel=selector)
+
+
+def tune(index: faiss.Index, config: Dict, vectors: np.ndarray, target_recall: float) -> Dict:
+    """Raise nprobe / efSearch until sampled recall@k against exact search reaches the target."""
+    rng = np.random.default_rng(0)
+    sample = vectors[rng.choice(len(vectors), size=min(TUNING_QUERIES, len(vectors)), replace=False)]
+    k = min(TUNING_K, len(vectors))
+    truth = exact_neighbors(vectors, sample, k)
+
+    if config["kind"] == "binary":
+        param, values = "rerank_factor", [1, 2, 4, 8, 16, 32, 64, 128, 256]
+    elif config["kind"] in ("ivf",) + COMPRESSED_KINDS:
+        nlist = config["nlist"]
+        param, values = "nprobe", [v for v in (1, 2, 4, 8, 16, 32, 64, 128, 256) if v < nlist] + [nlist]
+    else:
+        param, values = "ef_search", [16, 32, 64, 128, 256, 512]
+    recall = 0.0
+    for value in values:
+        config[param] = value
+        set_search_params(index, config)
+        recall = recall_at_k(index, sample, truth, k)
+        if recall >= target_recall:
+            break
+    config["tuned_recall"] = round(recall, 4)
+    return config
+
+
+def build_index(vectors: np.ndarray, kind: Optional[str] = None, compressed: bool = False,
+                target_recall: float = INDEX_TARGET_RECALL, pq_bytes: int = INDEX_PQ_BYTES,
+                binary: bool = False) -> Tuple[faiss.Index, Dict]:
+    """Build an L2 index over `vectors`, picking the type by corpus size unless `kind` is given.
+
+    With `compressed`, large corpora get an IVF-PQ (or OPQ + IVF-PQ) index, tuned for recall
+    after exact re-ranking; with `binary`, a sign-bit index whose shortlist is re-ranked the
+    same way. Returns the raw index and its config (type, build and tuned search
+    parameters), which is recorded in the manifest next to the index.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dimensions = vectors.shape
+    kind = kind or choose_index_kind(n, compressed, binary)
+    config = {"kind": kind, "vectors": n}
+    start = time.perf_counter()
+
+    if kind == "flat":
+        index = faiss.IndexFlatL2(dimensions)
+    elif kind == "ivf":
+        config["nlist"] = ivf_nlist(n)
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dimensions), dimensions, config["nlist"])
+        index.train(vectors)
+    elif kind == "hnsw":
+        config["m"] = 32
+        config["ef_construction"] = 200
+        index = faiss.IndexHNSWFlat(dimensions, config["m"])
+        index.hnsw.efConstruction = config["ef_construction"]
+    elif kind in COMPRESSED_KINDS:
+        config["nlist"] = ivf_nlist(n)
+        config["pq_bytes"] = pq_bytes
+        config["rerank_factor"] = INDEX_RERANK_FACTOR
+        prefix = f"OPQ{pq_bytes}," if kind == "opq" else ""
+        index = faiss.index_factory(dimensions, f"{prefix}IVF{config['nlist']},PQ{pq_bytes}")
+        index.train(vectors)
+    elif kind == "binary":
+        if dimensions % 8:
+            raise ValueError(f"Binary indices need a multiple of 8 dimensions, got {dimensions}")
+        config["rerank_factor"] = INDEX_RERANK_FACTOR
+        index = BinarySignIndex(faiss.IndexBinaryFlat(dimensions))
+    else:
+        raise ValueError(f"Unknown index kind {kind!r}")
+
+    index.add(vectors)
+    if kind in RERANKED_KINDS:
+        tune(RerankIndex(index, vectors, factor=config["rerank_factor"]), config, vectors, target_recall)
+    elif kind != "flat":
+        tune(index, config, vectors, target_recall)
+    config["build_seconds"] = round(time.perf_counter() - start, 3)
+    return index, config
+
+
+def needs_rebuild(config: Dict, n_vectors: int, compressed: bool = False, binary: bool = False) -> bool:
+    """Whether an index built with `config` should be retrained now that it holds `n_vectors`."""
+    kind = config.get("kind", "flat")
+    if kind != choose_index_kind(n_vectors, compressed, binary):
+        return True
+    if kind in ("ivf",) + COMPRESSED_KINDS:
+        # Too few lists for the corpus makes every probe scan long lists; retrain past 2x drift.
+        ideal = ivf_nlist(n_vectors)
+        return not (ideal / 2 <= config["nlist"] <= ideal * 2)
+    return False
@@ -0,0 +1,714 @@
+import json
+import os
+import pickle
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+import faiss
+import numpy as np
+from filelock import FileLock
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from docstore import DOCSTORE_FILE, PositionIdMap, SQLiteDocstore, write_docstore
+from index_builder import (
+    RERANKED_KINDS,
+    RerankIndex,
+    build_index,
+    choose_index_kind,
+    needs_rebuild,
+    read_index_file,
+    set_search_params,
+    write_index_file,
+)
+from metadata_index import METADATA_INDEX_FILE, MetadataIndex
+from routing import ROUTING_FILE, read_routing, routing_vectors, update_routing_vectors, write_routing
+from sparse_index import BM25_FILE, BM25Index
+
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", "vectordb")
+MANIFEST_FILE = "manifest.json"
+# Each write publishes a new immutable snapshot folder {document}/v{version}/; CURRENT names the
+# live one. Superseded snapshots stay readable for the grace period, then are removed.
+CURRENT_FILE = "CURRENT"
+SNAPSHOT_PATTERN = re.compile(r"v\d+")
+INDEX_SNAPSHOT_GRACE_SECONDS = float(os.getenv("INDEX_SNAPSHOT_GRACE_SECONDS", "600"))
+# Files kept beside the document folders (locks, version counters, tenant settings, folders being
+# deleted) carry this mark. quote() always escapes it, so no document name can reach them.
+SIDECAR_MARK = "+"
+LOCK_SUFFIX = SIDECAR_MARK + "lock"
+RETIRED_SUFFIX = SIDECAR_MARK + "old-"
+# Last version published for a document, kept beside its folder so that one deleted (or evicted)
+# and written again carries on from it: loaded indices and side indices are cached by version.
+VERSION_SUFFIX = SIDECAR_MARK + "version"
+# Append log of float32 vectors added since the last compaction.
+DELTA_FILE = "delta.vectors"
+# Float vectors kept beside approximate indices, used to retrain them as the corpus grows.
+VECTORS_FILE = "vectors.npy"
+# Fold the append log into index.faiss once it holds this share of the base index (or more rows).
+INDEX_COMPACT_DELTA_RATIO = float(os.getenv("INDEX_COMPACT_DELTA_RATIO", "0.25"))
+INDEX_COMPACT_MAX_DELTA = int(os.getenv("INDEX_COMPACT_MAX_DELTA", "50000"))
+# Approximate memory budget for loaded indices kept by IndexCache.
+INDEX_CACHE_BYTES = int(os.getenv("INDEX_CACHE_BYTES", str(1024 ** 3)))
+# Open index.faiss memory-mapped and read-only so workers share page-cache pages.
+INDEX_MMAP = os.getenv("INDEX_MMAP", "1") == "1"
+# Packed little-endian bitmap of deleted positions; compaction purges them past this share of rows.
+TOMBSTONE_FILE = "tombstones.bits"
+INDEX_PURGE_TOMBSTONE_RATIO = float(os.getenv("INDEX_PURGE_TOMBSTONE_RATIO", "0.2"))
+# Per-tenant settings live in {base}/{user}/+settings.json; these tenants default to compressed
+# (product-quantized) or binary (sign-bit) indices.
+TENANT_SETTINGS_FILE = SIDECAR_MARK + "settings.json"
+COMPRESSED_INDEX_TENANTS = set(filter(None, os.getenv("COMPRESSED_INDEX_TENANTS", "").split(",")))
+BINARY_INDEX_TENANTS = set(filter(None, os.getenv("BINARY_INDEX_TENANTS", "").split(",")))
+
+
+def mmap_flags(kind: str = "flat") -> int:
+    """faiss read flags that memory-map an index of the given kind.
+
+    IVF inverted lists are mapped by IO_FLAG_MMAP. Flat and HNSW storage needs
+    IO_FLAG_MMAP_IFC, which only newer faiss releases have, and which can't be combined
+    with IO_FLAG_MMAP on IVF indices.
+    """
+    ifc = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    if kind.startswith("ivf") or not ifc:
+        return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    return ifc | faiss.IO_FLAG_READ_ONLY
+
+
+def save_faiss(vector_store: FAISS, path: str) -> None:
+    """Write the index plus a SQLite docstore (no pickle) into the folder `path`."""
+    os.makedirs(path, exist_ok=True)
+    write_index_file(vector_store.index, os.path.join(path, "index.faiss"))
+    write_docstore(os.path.join(path, DOCSTORE_FILE), vector_store.docstore, vector_store.index_to_docstore_id)
+
+
+def stored_vectors(path: str, index: faiss.Index) -> np.ndarray:
+    """The float vectors of an index folder: vectors.npy if present, else read back from a flat index."""
+    vectors_path = os.path.join(path, VECTORS_FILE)
+    if os.path.exists(vectors_path):
+        return np.load(vectors_path, mmap_mode="r")
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def read_delta(path: str, delta_vectors: int, dimensions: int) -> np.ndarray:
+    if not delta_vectors:
+        # Indices that were never appended to have no append log.
+        return np.empty((0, dimensions), dtype=np.float32)
+    vectors = np.fromfile(os.path.join(path, DELTA_FILE), dtype=np.float32, count=delta_vectors * dimensions)
+    return vectors.reshape(delta_vectors, dimensions)
+
+
+def read_tombstones(path: str, size: int) -> np.ndarray:
+    """Bitmap of the deleted positions among the first `size`, padded with live (zero) bits."""
+    bitmap = np.zeros((size + 7) // 8, dtype=np.uint8)
+    try:
+        stored = np.fromfile(os.path.join(path, TOMBSTONE_FILE), dtype=np.uint8)
+    except FileNotFoundError:
+        return bitmap
+    n = min(len(stored), len(bitmap))
+    bitmap[:n] = stored[:n]
+    return bitmap
+
+
+@lru_cache(maxsize=1024)
+def load_tombstones(path: str, version: int, size: int) -> np.ndarray:
+    """`read_tombstones`, cached per index version; the result must not be modified."""
+    return read_tombstones(path, size)
+
+
+def read_index(path: str, mmap: bool = INDEX_MMAP, delta_vectors: int = 0,
+               config: Optional[Dict] = None, rerank: bool = True) -> faiss.Index:
+    """Read index.faiss plus the first `delta_vectors` rows of the append log.
+
+    A memory-mapped index is read-only, so an index with pending appends is read into
+    memory instead; compaction brings it back to the mmap path. Compressed and binary indices
+    are wrapped to re-rank their candidates against vectors.npy unless `rerank` is off.
+    """
+    config = config or {"kind": "flat"}
+    if delta_vectors:
+        mmap = False
+    flags = mmap_flags(config["kind"]) if mmap else 0
+    index = read_index_file(os.path.join(path, "index.faiss"), config["kind"], flags)
+    set_search_params(index, config)
+    delta = None
+    if delta_vectors:
+        delta = read_delta(path, delta_vectors, index.d)
+        index.add(delta)
+    if rerank and config["kind"] in RERANKED_KINDS:
+        vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+        index = RerankIndex(index, vectors, delta, factor=config["rerank_factor"])
+    return index
+
+
+def load_faiss(path: str, embeddings: Embeddings, mmap: bool = INDEX_MMAP, delta_vectors: int = 0,
+               config: Optional[Dict] = None) -> FAISS:
+    """Open an index folder, memory-mapping index.faiss unless `mmap` is off.
+
+    Chunks are read lazily from docstore.sqlite; folders written before the SQLite docstore
+    still carry a pickled index.pkl, which is loaded whole.
+    """
+    index = read_index(path, mmap, delta_vectors, config)
+    docstore_path = os.path.join(path, DOCSTORE_FILE)
+    if os.path.exists(docstore_path):
+        docstore = SQLiteDocstore(docstore_path)
+        return FAISS(embeddings, index, docstore, PositionIdMap(docstore))
+    with open(os.path.join(path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+def resident_size(path: str) -> int:
+    """Approximate memory held by a loaded index: the vectors, plus the docstore if it's pickled."""
+    return sum(
+        os.path.getsize(os.path.join(path, name))
+        for name in ("index.faiss", "index.pkl", DELTA_FILE)
+        if os.path.exists(os.path.join(path, name))
+    )
+
+
+class IndexCache:
+    """Process-level LRU of loaded vector stores, bounded by an approximate byte budget.
+
+    Entries are keyed by (store path, user, document, index version), so a re-ingested
+    document is never served from a stale entry even if another worker wrote it.
+    """
+
+    def __init__(self, budget_bytes: int = INDEX_CACHE_BYTES):
+        self.budget_bytes = budget_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str, str, int], Tuple[FAISS, int]]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Tuple[str, str, str, int]) -> Optional[FAISS]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Tuple[str, str, str, int], vector_store: FAISS, nbytes: int) -> None:
+        with self._lock:
+            # Older versions of the same index are dead weight once a newer one is loaded.
+            self._drop(lambda other: other[:3] == key[:3])
+            if nbytes > self.budget_bytes:
+                return
+            self._entries[key] = (vector_store, nbytes)
+            self.bytes += nbytes
+            while self.bytes > self.budget_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.bytes -= evicted_bytes
+                self.evictions += 1
+
+    def invalidate(self, base_path: str, user_id: str, document: str) -> None:
+        with self._lock:
+            self._drop(lambda key: key[:3] == (base_path, user_id, document))
+
+    def _drop(self, predicate) -> None:
+        for key in [key for key in self._entries if predicate(key)]:
+            _, nbytes = self._entries.pop(key)
+            self.bytes -= nbytes
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "budget_bytes": self.budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+index_cache = IndexCache()
+
+
+class IndexStore:
+    """On-disk vector indices namespaced as {base}/{user}/{document}/.
+
+    Writers to the same index are serialised with a file lock, so several uvicorn workers
+    can ingest for different tenants (or the same one) concurrently. Every write stages a new
+    snapshot folder and publishes it by swapping the CURRENT pointer, so a published snapshot
+    never changes: a reader that pins a manifest (see `read_manifest`) reads one consistent
+    version for as long as it needs, and loaded indices can be cached by version.
+    """
+
+    def __init__(self, base_path: str = VECTOR_STORE_DIR):
+        self.base_path = base_path
+
+    def user_path(self, user_id: str) -> str:
+        # Percent-encode so user names and filenames can't escape the store or collide with '/'.
+        return os.path.join(self.base_path, quote(user_id, safe=""))
+
+    def index_path(self, user_id: str, document: str) -> str:
+        return os.path.join(self.user_path(user_id), quote(document, safe=""))
+
+    def lock(self, user_id: str, document: str) -> FileLock:
+        os.makedirs(self.user_path(user_id), exist_ok=True)
+        return FileLock(self.index_path(user_id, document) + LOCK_SUFFIX)
+
+    def read_manifest(self, user_id: str, document: str) -> Optional[Dict]:
+        """Manifest of the document's current snapshot.
+
+        Pass it on to `load` and `snapshot_path` to pin that version for a whole request.
+        """
+        path = self.index_path(user_id, document)
+        try:
+            with open(os.path.join(path, CURRENT_FILE)) as f:
+                path = os.path.join(path, f.read().strip())
+        except FileNotFoundError:
+            pass
+        try:
+            with open(os.path.join(path, MANIFEST_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def snapshot_path(self, user_id: str, document: str, manifest: Dict) -> str:
+        """Folder holding the files of the snapshot `manifest` describes."""
+        path = self.index_path(user_id, document)
+        # Indices written before versioned snapshots keep their files directly in the document folder.
+        return os.path.join(path, manifest["snapshot"]) if "snapshot" in manifest else path
+
+    @staticmethod
+    def _write_manifest(path: str, manifest: Dict) -> None:
+        # Readers trust the manifest's counts, so it must never be seen half-written.
+        tmp_path = os.path.join(path, f"{MANIFEST_FILE}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(path, MANIFEST_FILE))
+
+    @staticmethod
+    def _staging(path: str) -> str:
+        staging = os.path.join(path, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(staging)
+        return staging
+
+    @staticmethod
+    def _link_snapshot(source: str, staging: str, skip: Tuple[str, ...] = ()) -> None:
+        """Hard-link the files of snapshot `source` into `staging`, except its manifest and `skip`.
+
+        The append log and docstore are shared this way rather than copied: appends only add
+        rows past the counts older manifests record, which readers of those never look at.
+        """
+        for name in os.listdir(source):
+            if name in skip or name in (MANIFEST_FILE, CURRENT_FILE) or name.endswith(".tmp"):
+                continue
+            if os.path.isfile(os.path.join(source, name)):
+                os.link(os.path.join(source, name), os.path.join(staging, name))
+
+    @staticmethod
+    def _last_version(path: str) -> int:
+        try:
+            with open(path + VERSION_SUFFIX) as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _publish(self, path: str, staging: str, manifest: Dict) -> Dict:
+        """Turn a fully written staging folder into snapshot v{version} and point CURRENT at it.
+
+        CURRENT is replaced with an atomic rename, so readers resolve either the old snapshot or
+        the new one, never a mix of the two. Returns the manifest as published.
+        """
+        snapshot = f"v{manifest['version']:06d}"
+        manifest = {**manifest, "snapshot": snapshot, "published_at": time.time()}
+        self._write_manifest(staging, manifest)
+        target = os.path.join(path, snapshot)
+        if os.path.exists(target):
+            # Left by a writer that crashed before swapping CURRENT; no reader has seen it.
+            shutil.rmtree(target)
+        os.rename(staging, target)
+        tmp_path = os.path.join(path, CURRENT_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(path, CURRENT_FILE))
+        if manifest["version"] > self._last_version(path):
+            with open(path + VERSION_SUFFIX + ".tmp", "w") as f:
+                f.write(str(manifest["version"]))
+            os.replace(path + VERSION_SUFFIX + ".tmp", path + VERSION_SUFFIX)
+        self._collect_garbage(path, snapshot)
+        return manifest
+
+    @staticmethod
+    def _collect_garbage(path: str, current: str) -> None:
+        """Remove snapshots superseded more than INDEX_SNAPSHOT_GRACE_SECONDS ago.
+
+        Runs under the document lock, so any staging folder left is from a crashed writer.
+        The grace period is what keeps snapshots pinned by in-flight requests (in any worker)
+        readable; the current snapshot is never removed.
+        """
+        now = time.time()
+        published = {}
+        for name in os.listdir(path):
+            entry = os.path.join(path, name)
+            if name.startswith(".tmp-"):
+                shutil.rmtree(entry, ignore_errors=True)
+            elif SNAPSHOT_PATTERN.fullmatch(name) and os.path.isdir(entry):
+                try:
+                    with open(os.path.join(entry, MANIFEST_FILE)) as f:
+                        published[name] = json.load(f)["published_at"]
+                except (FileNotFoundError, KeyError, ValueError):
+                    published[name] = os.path.getmtime(entry)
+        snapshots = sorted(published, key=lambda name: int(name[1:]))
+        # A snapshot was superseded when the next one was published.
+        for older, newer in zip(snapshots, snapshots[1:]):
+            if int(older[1:]) < int(current[1:]) and now - published[newer] >= INDEX_SNAPSHOT_GRACE_SECONDS:
+                shutil.rmtree(os.path.join(path, older), ignore_errors=True)
+        legacy = os.path.exists(os.path.join(path, MANIFEST_FILE))
+        if legacy and snapshots and now - published[snapshots[0]] >= INDEX_SNAPSHOT_GRACE_SECONDS:
+            for name in os.listdir(path):
+                if name != CURRENT_FILE and os.path.isfile(os.path.join(path, name)):
+                    os.remove(os.path.join(path, name))
+
+    def tenant_settings(self, user_id: str) -> Dict:
+        settings = {"compressed": user_id in COMPRESSED_INDEX_TENANTS, "binary": user_id in BINARY_INDEX_TENANTS}
+        try:
+            with open(os.path.join(self.user_path(user_id), TENANT_SETTINGS_FILE)) as f:
+                settings.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        return settings
+
+    def set_tenant_settings(self, user_id: str, **settings) -> Dict:
+        """Update a tenant's settings, e.g. `compressed=True` or `binary=True`; applies from the next build or compaction."""
+        os.makedirs(self.user_path(user_id), exist_ok=True)
+        with FileLock(os.path.join(self.user_path(user_id), TENANT_SETTINGS_FILE + ".lock")):
+            current = self.tenant_settings(user_id)
+            current.update(settings)
+            tmp_path = os.path.join(self.user_path(user_id), TENANT_SETTINGS_FILE + ".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(current, f)
+            os.replace(tmp_path, os.path.join(self.user_path(user_id), TENANT_SETTINGS_FILE))
+        return current
+
+    def exists(self, user_id: str, document: str) -> bool:
+        return self.read_manifest(user_id, document) is not None
+
+    def save(self, user_id: str, document: str, vector_store: FAISS) -> Dict:
+        """Write `vector_store` as the index of `document`, replacing any previous one.
+
+        The exact index built by `FAISS.from_documents` is swapped for an IVF or HNSW index
+        when the corpus is large enough, or for a product-quantized or binary one for tenants
+        with those settings; the chosen parameters go in the manifest.
+        """
+        path = self.index_path(user_id, document)
+        settings = self.tenant_settings(user_id)
+        compressed, binary = settings["compressed"], settings["binary"]
+        vectors = vector_store.index.reconstruct_n(0, vector_store.index.ntotal)
+        config = {"kind": "flat", "vectors": len(vectors)}
+        if choose_index_kind(len(vectors), compressed, binary) != "flat":
+            vector_store.index, config = build_index(vectors, compressed=compressed, binary=binary)
+        with self.lock(user_id, document):
+            previous = self.read_manifest(user_id, document)
+            manifest = {
+                "user": user_id,
+                "document": document,
+                "version": max(previous["version"] if previous else 0, self._last_version(path)) + 1,
+                "vectors": vector_store.index.ntotal,
+                "delta_vectors": 0,
+                "dimensions": vector_store.index.d,
+                "index": config,
+                "created_at": time.time(),
+            }
+            staging = self._staging(path)
+            save_faiss(vector_store, staging)
+            if config["kind"] != "flat":
+                np.save(os.path.join(staging, VECTORS_FILE), vectors)
+            chunks = [vector_store.docstore.search(vector_store.index_to_docstore_id[i]) for i in range(len(vectors))]
+            self._write_side_indices(staging, vectors, chunks)
+            manifest = self._publish(path, staging, manifest)
+        index_cache.invalidate(self.base_path, user_id, document)
+        return manifest
+
+    @staticmethod
+    def _write_side_indices(path: str, vectors: np.ndarray, chunks: List[Document]) -> None:
+        """Routing vectors, metadata bitmaps and BM25 index for `chunks`, in index position order."""
+        write_routing(path, routing_vectors(vectors))
+        MetadataIndex().extend(0, (chunk.metadata for chunk in chunks)).save(path)
+        BM25Index().extend(0, (chunk.page_content for chunk in chunks)).save(path)
+
+    def append(self, user_id: str, document: str, chunks: List[Document], embeddings: Embeddings,
+               replaces: Optional[str] = None) -> Dict:
+        """Embed `chunks` and add them to an existing index without rebuilding it.
+
+        Only the delta is written: the vectors go to the append log and the chunks to the
+        docstore, both shared with the current snapshot past its recorded counts. The new
+        snapshot links everything else and carries the updated side indices.
+
+        `replaces` names an uploaded file whose earlier chunks the new ones supersede; they are
+        tombstoned in the same snapshot, so uploading a file again doesn't duplicate it.
+        """
+        vectors = np.asarray(embeddings.embed_documents([chunk.page_content for chunk in chunks]), dtype=np.float32)
+        path = self.index_path(user_id, document)
+        with self.lock(user_id, document):
+            manifest = self.read_manifest(user_id, document)
+            if manifest is None:
+                raise ValueError(f"Vector store not found for user {user_id} and file {document}")
+            if not chunks:
+                return manifest
+            committed = manifest.get("delta_vectors", 0)
+            start = manifest["vectors"] + committed
+            source = self.snapshot_path(user_id, document, manifest)
+
+            # Written through the current snapshot's paths, so a hot SQLite journal left by a
+            # crash sits next to the database readers open.
+            with open(os.path.join(source, DELTA_FILE), "ab") as f:
+                # Drop rows left behind by an append that crashed before its manifest update.
+                f.truncate(committed * vectors.shape[1] * 4)
+                f.write(vectors.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+            docstore = SQLiteDocstore(os.path.join(source, DOCSTORE_FILE), read_only=False)
+            try:
+                with docstore.connection as connection:
+                    connection.execute("DELETE FROM chunks WHERE position >= ?", (start,))
+                docstore.add_at({start + i: (str(uuid.uuid4()), chunk) for i, chunk in enumerate(chunks)})
+            finally:
+                docstore.close()
+
+            replaced = []
+            if replaces:
+                deleted = np.unpackbits(read_tombstones(source, start), count=start, bitorder="little").astype(bool)
+                replaced = [position for position in self._file_positions(source, start, replaces)
+                            if not deleted[position]]
+
+            staging = self._staging(path)
+            skip = (ROUTING_FILE, METADATA_INDEX_FILE, BM25_FILE) + ((TOMBSTONE_FILE,) if replaced else ())
+            self._link_snapshot(source, staging, skip=skip)
+            if replaced:
+                deleted[replaced] = True
+                np.packbits(deleted, bitorder="little").tofile(os.path.join(staging, TOMBSTONE_FILE))
+                manifest = {**manifest, "tombstones": int(deleted.sum())}
+            routing = read_routing(source)
+            if routing is not None:
+                write_routing(staging, update_routing_vectors(routing, start, vectors))
+            metadata_index = MetadataIndex.load(source)
+            if metadata_index is not None:
+                metadata_index.extend(start, (chunk.metadata for chunk in chunks)).save(staging)
+            bm25_index = BM25Index.load(source)
+            if bm25_index is not None:
+                bm25_index.extend(start, (chunk.page_content for chunk in chunks)).save(staging)
+
+            manifest = {**manifest, "version": manifest["version"] + 1, "delta_vectors": committed + len(chunks)}
+            manifest = self._publish(path, staging, manifest)
+        index_cache.invalidate(self.base_path, user_id, document)
+        return manifest
+
+    @staticmethod
+    def needs_compaction(manifest: Dict) -> bool:
+        delta = manifest.get("delta_vectors", 0)
+        tombstones = manifest.get("tombstones", 0)
+        return (delta >= INDEX_COMPACT_MAX_DELTA or delta > manifest["vectors"] * INDEX_COMPACT_DELTA_RATIO
+                or tombstones > (manifest["vectors"] + delta) * INDEX_PURGE_TOMBSTONE_RATIO)
+
+    def compact(self, user_id: str, document: str) -> Optional[Dict]:
+        """Fold the append log back into index.faiss so the index can be memory-mapped again.
+
+        If the corpus has crossed an index-type threshold the index is rebuilt (and retrained)
+        from the stored float vectors; otherwise the log is simply added to it. Deleted chunks
+        are purged: the surviving rows are renumbered and every file is rewritten for them.
+        The result is published as a new snapshot, so readers are never blocked.
+        """
+        path = self.index_path(user_id, document)
+        settings = self.tenant_settings(user_id)
+        compressed, binary = settings["compressed"], settings["binary"]
+        with self.lock(user_id, document):
+            manifest = self.read_manifest(user_id, document)
+            if manifest is None or not (manifest.get("delta_vectors") or manifest.get("tombstones")):
+                return manifest
+            config = manifest.get("index", {"kind": "flat"})
+            source = self.snapshot_path(user_id, document, manifest)
+            base = read_index(source, mmap=False, config=config, rerank=False)
+            delta = read_delta(source, manifest.get("delta_vectors", 0), base.d)
+            staging = self._staging(path)
+
+            if manifest.get("tombstones"):
+                total = base.ntotal + len(delta)
+                deleted = np.unpackbits(read_tombstones(source, total), count=total, bitorder="little").astype(bool)
+                keep = np.flatnonzero(~deleted)
+                vectors = np.vstack([stored_vectors(source, base), delta])[keep]
+                index, config = build_index(vectors, compressed=compressed, binary=binary)
+                old_docstore = SQLiteDocstore(os.path.join(source, DOCSTORE_FILE))
+                new_docstore = SQLiteDocstore(os.path.join(staging, DOCSTORE_FILE), read_only=False)
+                try:
+                    rows = [(doc_id, doc) for position, doc_id, doc in old_docstore.rows()
+                            if position < total and not deleted[position]]
+                    new_docstore.add_at(dict(enumerate(rows)))
+                finally:
+                    old_docstore.close()
+                    new_docstore.close()
+                self._write_side_indices(staging, vectors, [doc for _, doc in rows])
+            else:
+                rebuild = needs_rebuild(config, base.ntotal + len(delta), compressed, binary)
+                vectors = None
+                if config["kind"] != "flat" or rebuild:
+                    vectors = np.vstack([stored_vectors(source, base), delta])
+                if rebuild:
+                    index, config = build_index(vectors, compressed=compressed, binary=binary)
+                else:
+                    index = base
+                    index.add(delta)
+                    config = {**config, "vectors": index.ntotal}
+                # Docstore and side indices are unchanged by folding in the log.
+                self._link_snapshot(source, staging, skip=("index.faiss", VECTORS_FILE, DELTA_FILE, TOMBSTONE_FILE))
+
+            write_index_file(index, os.path.join(staging, "index.faiss"))
+            if config["kind"] != "flat":
+                np.save(os.path.join(staging, VECTORS_FILE), vectors)
+            manifest = {
+                **manifest,
+                "version": manifest["version"] + 1,
+                "vectors": index.ntotal,
+                "delta_vectors": 0,
+                "tombstones": 0,
+                "index": config,
+            }
+            manifest = self._publish(path, staging, manifest)
+        index_cache.invalidate(self.base_path, user_id, document)
+        print(f"Compacted index {user_id}/{document} to {index.ntotal} vectors")
+        return manifest
+
+    def delete(self, user_id: str, document: str) -> None:
+        """Remove a document's index entirely.
+
+        The folder is renamed away under the lock and removed afterwards; searches that already
+        opened its files finish on them.
+        """
+        path = self.index_path(user_id, document)
+        with self.lock(user_id, document):
+            if self.read_manifest(user_id, document) is None:
+                raise ValueError(f"Vector store not found for user {user_id} and file {document}")
+            retired = f"{path}{RETIRED_SUFFIX}{uuid.uuid4().hex}"
+            os.rename(path, retired)
+        shutil.rmtree(retired, ignore_errors=True)
+        index_cache.invalidate(self.base_path, user_id, document)
+
+    @staticmethod
+    def _file_positions(source: str, total: int, filename: str) -> List[int]:
+        """Positions below `total` in snapshot `source` holding chunks of the uploaded file `filename`."""
+        docstore = SQLiteDocstore(os.path.join(source, DOCSTORE_FILE))
+        try:
+            return [
+                position
+                for position, metadata in docstore.connection.execute("SELECT position, metadata FROM chunks")
+                if position < total and os.path.basename(json.loads(metadata).get("source", "")) == filename
+            ]
+        finally:
+            docstore.close()
+
+    def delete_file(self, user_id: str, document: str, filename: str) -> Optional[Dict]:
+        """Tombstone the chunks one uploaded file contributed to a collection.
+
+        Searches skip them from the next query on; `compact` purges them once `needs_compaction`
+        says so. Returns the new manifest, or None if the file was all that was left and the
+        whole index was deleted.
+        """
+        path = self.index_path(user_id, document)
+        with self.lock(user_id, document):
+            manifest = self.read_manifest(user_id, document)
+            if manifest is None:
+                raise ValueError(f"Vector store not found for user {user_id} and file {document}")
+            source = self.snapshot_path(user_id, document, manifest)
+            if not os.path.exists(os.path.join(source, DOCSTORE_FILE)):
+                raise ValueError(f"Index {document} predates deletion support; upload it again to delete from it")
+            total = manifest["vectors"] + manifest.get("delta_vectors", 0)
+            deleted = np.unpackbits(read_tombstones(source, total), count=total, bitorder="little").astype(bool)
+            matched = self._file_positions(source, total, filename)
+            if not matched or deleted[matched].all():
+                raise ValueError(f"File {filename} not found in {document}")
+            deleted[matched] = True
+            if not deleted.all():
+                staging = self._staging(path)
+                self._link_snapshot(source, staging, skip=(TOMBSTONE_FILE,))
+                np.packbits(deleted, bitorder="little").tofile(os.path.join(staging, TOMBSTONE_FILE))
+                manifest = {**manifest, "version": manifest["version"] + 1, "tombstones": int(deleted.sum())}
+                manifest = self._publish(path, staging, manifest)
+        if deleted.all():
+            self.delete(user_id, document)
+            return None
+        index_cache.invalidate(self.base_path, user_id, document)
+        return manifest
+
+    def restore(self, user_id: str, document: str, version: int, fetch: Callable[[str], Dict]) -> Dict:
+        """Publish a snapshot copied from elsewhere (e.g. object storage) as the current one.
+
+        `fetch(staging)` fills an empty staging folder and returns the snapshot's manifest;
+        nothing is published if it raises. If version `version` or a later one is already
+        current (another worker restored it first), that manifest is returned instead.
+        """
+        path = self.index_path(user_id, document)
+        with self.lock(user_id, document):
+            manifest = self.read_manifest(user_id, document)
+            if manifest is not None and manifest["version"] >= version:
+                return manifest
+            os.makedirs(path, exist_ok=True)
+            staging = self._staging(path)
+            try:
+                manifest = fetch(staging)
+            except BaseException:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+            manifest = self._publish(path, staging, manifest)
+        index_cache.invalidate(self.base_path, user_id, document)
+        return manifest
+
+    def load(self, user_id: str, document: str, embeddings: Embeddings, manifest: Optional[Dict] = None) -> FAISS:
+        """Return the loaded index of the snapshot `manifest` pins, or of the current one.
+
+        Published snapshots never change, so a cached index stays valid for its version and a
+        cache hit with a pinned manifest touches no files at all.
+        """
+        manifest = manifest or self.read_manifest(user_id, document)
+        if manifest is None:
+            raise ValueError(f"Vector store not found for user {user_id} and file {document}")
+
+        key = (self.base_path, user_id, document, manifest["version"])
+        vector_store = index_cache.get(key)
+        if vector_store is None:
+            path = self.snapshot_path(user_id, document, manifest)
+            vector_store = load_faiss(path, embeddings, delta_vectors=manifest.get("delta_vectors", 0),
+                                      config=manifest.get("index"))
+            index_cache.put(key, vector_store, resident_size(path))
+        return vector_store
+
+    def list_documents(self, user_id: str) -> List[Dict]:
+        """Manifests of all of a user's indices, most recently written first."""
+        user_path = self.user_path(user_id)
+        if not os.path.isdir(user_path):
+            return []
+        manifests = []
+        for entry in os.listdir(user_path):
+            if SIDECAR_MARK in entry or not os.path.isdir(os.path.join(user_path, entry)):
+                continue
+            manifest = self.read_manifest(user_id, unquote(entry))
+            if manifest:
+                manifests.append(manifest)
+        return sorted(manifests, key=lambda m: m["created_at"], reverse=True)
+
+    def latest_document(self, user_id: str) -> str:
+        documents = self.list_documents(user_id)
+        if not documents:
+            raise ValueError(f"No documents have been uploaded for user {user_id}")
+        return documents[0]["document"]
+
+
+index_store = IndexStore()
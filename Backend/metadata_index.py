@@ -0,0 +1,130 @@
+import json
+import os
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from docstore import DOCSTORE_FILE, SQLiteDocstore
+from index_builder import search_parameters
+
+# Chunk metadata fields that get a bitmap per value, and the file holding them next to each index.
+METADATA_INDEX_FIELDS = tuple(
+    filter(None, os.getenv("METADATA_INDEX_FIELDS", "source,file_type,element_type").split(","))
+)
+METADATA_INDEX_FILE = "metadata.npz"
+METADATA_CACHE_ENTRIES = int(os.getenv("METADATA_CACHE_ENTRIES", "1024"))
+
+
+class MetadataIndex:
+    """Bitmaps of chunk positions per (field, value), in the layout faiss.IDSelectorBitmap reads.
+
+    Bit i (little bit order) of the bitmap for ("element_type", "Title") is set when the chunk
+    at index position i is a Title element. A filter ORs the bitmaps of the values allowed for
+    a field and ANDs the fields together.
+    """
+
+    def __init__(self, size: int = 0, bitmaps: Optional[Dict[Tuple[str, str], np.ndarray]] = None):
+        self.size = size
+        self.bitmaps = bitmaps or {}
+
+    def extend(self, start: int, metadatas: Iterable[Dict]) -> "MetadataIndex":
+        """Index the chunks at positions `start`, `start + 1`, ...; anything from `start` on is replaced."""
+        metadatas = list(metadatas)
+        size = start + len(metadatas)
+        bits = {key: np.unpackbits(bitmap, count=start, bitorder="little").astype(bool)
+                for key, bitmap in self.bitmaps.items()}
+        bits = {key: np.concatenate([values, np.zeros(len(metadatas), dtype=bool)]) for key, values in bits.items()}
+        for offset, metadata in enumerate(metadatas):
+            for field in METADATA_INDEX_FIELDS:
+                if field in metadata:
+                    key = (field, str(metadata[field]))
+                    if key not in bits:
+                        bits[key] = np.zeros(size, dtype=bool)
+                    bits[key][start + offset] = True
+        return MetadataIndex(size, {key: np.packbits(values, bitorder="little") for key, values in bits.items()})
+
+    def select(self, filters: Dict[str, List[str]]) -> np.ndarray:
+        """Packed bitmap of the chunks matching every field of `filters` (any of its values)."""
+        selected = np.full((self.size + 7) // 8, 0xFF, dtype=np.uint8)
+        for field, values in filters.items():
+            if field not in METADATA_INDEX_FIELDS:
+                raise ValueError(f"Metadata field {field!r} is not indexed")
+            if isinstance(values, str):
+                values = [values]
+            matches = np.zeros_like(selected)
+            for value in values:
+                bitmap = self.bitmaps.get((field, str(value)))
+                if bitmap is not None:
+                    matches |= bitmap
+            selected &= matches
+        return selected
+
+    def save(self, path: str) -> None:
+        keys = list(self.bitmaps)
+        tmp_path = os.path.join(path, METADATA_INDEX_FILE + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, size=np.int64(self.size), keys=np.array([json.dumps(key) for key in keys]),
+                     **{f"b{i}": self.bitmaps[key] for i, key in enumerate(keys)})
+        os.replace(tmp_path, os.path.join(path, METADATA_INDEX_FILE))
+
+    @classmethod
+    def load(cls, path: str) -> Optional["MetadataIndex"]:
+        try:
+            with np.load(os.path.join(path, METADATA_INDEX_FILE)) as data:
+                keys = [tuple(json.loads(key)) for key in data["keys"]]
+                return cls(int(data["size"]), {key: data[f"b{i}"] for i, key in enumerate(keys)})
+        except FileNotFoundError:
+            return None
+
+
+def matches(metadata: Dict, filters: Dict[str, List[str]]) -> bool:
+    """Whether one chunk's metadata passes `filters`, with the same semantics as `MetadataIndex.select`."""
+    for field, values in filters.items():
+        if isinstance(values, str):
+            values = [values]
+        if field not in metadata or str(metadata[field]) not in {str(value) for value in values}:
+            return False
+    return True
+
+
+@lru_cache(maxsize=METADATA_CACHE_ENTRIES)
+def load_metadata_index(path: str, version: int) -> Optional[MetadataIndex]:
+    """MetadataIndex of an index folder, cached per index version.
+
+    Folders written before metadata.npz existed get one built from their docstore; only
+    pickled legacy docstores return None.
+    """
+    metadata_index = MetadataIndex.load(path)
+    if metadata_index is None and os.path.exists(os.path.join(path, DOCSTORE_FILE)):
+        docstore = SQLiteDocstore(os.path.join(path, DOCSTORE_FILE))
+        try:
+            metadata_index = MetadataIndex().extend(0, (doc.metadata for _, _, doc in docstore.rows()))
+        finally:
+            docstore.close()
+    return metadata_index
+
+
+def filtered_search(vector_store: FAISS, config: Dict, query_vector: List[float], k: int,
+                    allowed: np.ndarray) -> List[Tuple[Document, float]]:
+    """Nearest chunks among the positions set in the packed bitmap `allowed`, restricted inside the index search.
+
+    Unlike a post-filter, excluded chunks never take up any of the k results, and faiss skips
+    their distance computations, so the more selective the filter the cheaper the search.
+    """
+    if not allowed.any():
+        return []
+    # IDSelectorBitmap takes the bitmap's length in bytes and only borrows it: keep `allowed` alive.
+    selector = faiss.IDSelectorBitmap(len(allowed), faiss.swig_ptr(allowed))
+    params = search_parameters(config, selector)
+    query = np.array([query_vector], dtype=np.float32)
+    distances, labels = vector_store.index.search(query, k, params=params)
+    hits = []
+    for distance, label in zip(distances[0], labels[0]):
+        if label == -1:
+            continue
+        hits.append((vector_store.docstore.search(vector_store.index_to_docstore_id[label]), float(distance)))
+    return hits
@@ -0,0 +1,59 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict
+
+
+class LatencyStats:
+    """Thread-safe latency recorder keeping a bounded window of samples for percentiles."""
+
+    def __init__(self, window: int = 2048):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)
+        self.calls = 0
+        self.items = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds: float, items: int = 1) -> None:
+        """Record one call that took `seconds` and handled `items` inputs."""
+        with self._lock:
+            self._samples.append(seconds)
+            self.calls += 1
+            self.items += items
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    @contextmanager
+    def time(self, items: int = 1):
+        """Context manager recording the wall time of the enclosed block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(time.perf_counter() - start, items)
+
+    def percentile(self, q: float) -> float:
+        """Return the q-th percentile (0-100) of the recent samples, in seconds."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return 0.0
+        index = min(len(samples) - 1, int(round(q / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+    def snapshot(self) -> Dict[str, float]:
+        """Return a JSON-serialisable summary of the recorded calls."""
+        with self._lock:
+            calls, items, total, peak = self.calls, self.items, self.total_seconds, self.max_seconds
+        return {
+            "calls": calls,
+            "items": items,
+            "total_seconds": round(total, 6),
+            "mean_ms": round(total / calls * 1000, 3) if calls else 0.0,
+            "p50_ms": round(self.percentile(50) * 1000, 3),
+            "p99_ms": round(self.percentile(99) * 1000, 3),
+            "max_ms": round(peak * 1000, 3),
+            "items_per_second": round(items / total, 2) if total else 0.0,
+        }
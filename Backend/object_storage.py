@@ -0,0 +1,345 @@
+import hashlib
+import os
+import random
+import shutil
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import boto3
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from metrics import LatencyStats
+
+# Read size for hashing and copying files.
+CHUNK_BYTES = 1024 * 1024
+# Managed S3 transfers: files past the threshold go multipart in parts of S3_MULTIPART_CHUNK_BYTES.
+# Up to S3_MAX_CONCURRENCY requests (parts of any of the files) run at once over one shared
+# connection pool.
+S3_MULTIPART_THRESHOLD_BYTES = int(os.getenv("S3_MULTIPART_THRESHOLD_BYTES", str(16 * 1024 ** 2)))
+# S3 rejects parts under 5 MiB other than the last, so smaller settings are raised to that.
+S3_MIN_PART_BYTES = 5 * 1024 ** 2
+S3_MULTIPART_CHUNK_BYTES = max(int(os.getenv("S3_MULTIPART_CHUNK_BYTES", str(16 * 1024 ** 2))), S3_MIN_PART_BYTES)
+S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", "16"))
+# Streamed uploads (`stream_upload`) buffer one part of S3_MULTIPART_CHUNK_BYTES and keep up to
+# S3_UPLOAD_PARTS_IN_FLIGHT parts uploading at once, so an upload holds at most that many parts
+# in memory whatever the file's size.
+S3_UPLOAD_PARTS_IN_FLIGHT = int(os.getenv("S3_UPLOAD_PARTS_IN_FLIGHT", "4"))
+# botocore retries each request (exponential backoff with jitter); a transfer that still fails
+# is restarted up to S3_TRANSFER_ATTEMPTS times in all, backing off from S3_RETRY_BACKOFF_SECONDS.
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", "5"))
+S3_TRANSFER_ATTEMPTS = int(os.getenv("S3_TRANSFER_ATTEMPTS", "3"))
+S3_RETRY_BACKOFF_SECONDS = float(os.getenv("S3_RETRY_BACKOFF_SECONDS", "0.5"))
+# An S3-compatible endpoint (MinIO, moto server) to run against instead of AWS, e.g. in tests.
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def s3_client(endpoint_url: Optional[str] = S3_ENDPOINT_URL):
+    """S3 client with a connection pool sized for S3_MAX_CONCURRENCY concurrent requests."""
+    config = Config(max_pool_connections=S3_MAX_CONCURRENCY,
+                    retries={"max_attempts": S3_MAX_ATTEMPTS, "mode": "standard"})
+    return boto3.client("s3", endpoint_url=endpoint_url, config=config)
+
+
+def transfer_config() -> TransferConfig:
+    return TransferConfig(multipart_threshold=S3_MULTIPART_THRESHOLD_BYTES,
+                          multipart_chunksize=S3_MULTIPART_CHUNK_BYTES, max_concurrency=S3_MAX_CONCURRENCY)
+
+
+def retryable(error: Exception) -> bool:
+    """Whether a failed transfer is worth restarting: not for client errors such as a missing key."""
+    if isinstance(error, ClientError):
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 500)
+        return status >= 500 or status == 429
+    return True
+
+
+def backoff_seconds(attempt: int) -> float:
+    """Exponential backoff with jitter before retry number `attempt` (from 1)."""
+    return S3_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1) * (0.5 + random.random())
+
+
+def transfer_stats(uploads: LatencyStats, downloads: LatencyStats) -> Dict[str, Dict[str, float]]:
+    # items are bytes, so items_per_second is the transfer rate in bytes/sec.
+    return {"uploads": uploads.snapshot(), "downloads": downloads.snapshot()}
+
+
+class FileUpload:
+    """A file written chunk by chunk to `path`, hashed as it goes, and uploaded to `key` on `complete`.
+
+    What `LocalStorage.stream_upload` returns; `MultipartUpload` sends S3 parts while writing.
+    """
+
+    def __init__(self, storage, path: str, key: str):
+        self.storage = storage
+        self.path = path
+        self.key = key
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self.file = open(path, "wb")
+
+    def write(self, chunk: bytes) -> None:
+        self.file.write(chunk)
+        self.digest.update(chunk)
+        self.size += len(chunk)
+
+    def complete(self) -> str:
+        """Finish the upload; returns the file's SHA-256."""
+        self.file.close()
+        self.storage.upload_files([(self.path, self.key)])
+        return self.digest.hexdigest()
+
+    def abort(self) -> None:
+        self.file.close()
+
+
+class MultipartUpload(FileUpload):
+    """A `FileUpload` that sends each full part to S3 as soon as it's written.
+
+    Parts upload in the background on the storage's thread pool, up to S3_UPLOAD_PARTS_IN_FLIGHT
+    at a time; `write` waits for one to finish past that. A file smaller than one part goes
+    up in a single PUT on `complete`.
+    """
+
+    def __init__(self, storage: "S3Storage", path: str, key: str):
+        super().__init__(storage, path, key)
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+        self.start = time.perf_counter()
+
+    def write(self, chunk: bytes) -> None:
+        super().write(chunk)
+        self.buffer += chunk
+        while len(self.buffer) >= S3_MULTIPART_CHUNK_BYTES:
+            self._send(bytes(self.buffer[:S3_MULTIPART_CHUNK_BYTES]))
+            del self.buffer[:S3_MULTIPART_CHUNK_BYTES]
+
+    def _send(self, data: bytes) -> None:
+        if self.upload_id is None:
+            self.upload_id = self.storage.client.create_multipart_upload(
+                Bucket=self.storage.bucket_name, Key=self.key)["UploadId"]
+        pending = [future for _, future in self.parts if not future.done()]
+        while len(pending) >= S3_UPLOAD_PARTS_IN_FLIGHT:
+            pending = list(wait(pending, return_when=FIRST_COMPLETED).not_done)
+        for _, future in self.parts:
+            if future.done():
+                future.result()  # surface a failed part now rather than at the end
+        number = len(self.parts) + 1
+        self.parts.append((number, self.storage.executor.submit(
+            self.storage.upload_part, self.key, self.upload_id, number, data)))
+
+    def complete(self) -> str:
+        self.file.close()
+        if self.upload_id is None:
+            self.storage.put_bytes(self.key, bytes(self.buffer))
+        else:
+            if self.buffer:
+                self._send(bytes(self.buffer))
+            parts = [{"PartNumber": number, "ETag": future.result()} for number, future in self.parts]
+            self.storage.client.complete_multipart_upload(Bucket=self.storage.bucket_name, Key=self.key,
+                                                          UploadId=self.upload_id, MultipartUpload={"Parts": parts})
+        self.buffer = bytearray()
+        self.storage.uploads.record(time.perf_counter() - self.start, items=self.size)
+        return self.digest.hexdigest()
+
+    def abort(self) -> None:
+        super().abort()
+        self.buffer = bytearray()
+        if self.upload_id is None:
+            return
+        for _, future in self.parts:
+            future.cancel()
+        wait([future for _, future in self.parts])
+        try:
+            self.storage.client.abort_multipart_upload(Bucket=self.storage.bucket_name, Key=self.key,
+                                                       UploadId=self.upload_id)
+        except ClientError as e:
+            # Left for the bucket's lifecycle rule on incomplete multipart uploads.
+            print(f"Aborting multipart upload of {self.key} failed: {str(e)}")
+
+
+class S3Storage:
+    """Object storage in an S3 bucket, moved with s3transfer managed transfers.
+
+    Batches of files are submitted together to one transfer manager, so they upload or
+    download in parallel (large ones in multipart parts) over a shared connection pool.
+    `LocalStorage` has the same methods and stands in for it in tests and local development;
+    pass a client for an S3-compatible stand-in (or set S3_ENDPOINT_URL) to test this class.
+    """
+
+    def __init__(self, bucket_name: str, client=None, config: Optional[TransferConfig] = None):
+        self.bucket_name = bucket_name
+        self.client = client or s3_client()
+        self.manager = create_transfer_manager(self.client, config or transfer_config())
+        # Parts of streamed uploads (`stream_upload`).
+        self.executor = ThreadPoolExecutor(max_workers=S3_MAX_CONCURRENCY)
+        self.uploads = LatencyStats()
+        self.downloads = LatencyStats()
+
+    def _run_all(self, submit: Callable, files: Sequence[Tuple[str, str]], action: str) -> None:
+        """Start every (path, key) transfer at once, then restart the failed ones with backoff."""
+        futures = [(path, key, submit(path, key)) for path, key in files]
+        for path, key, future in futures:
+            for attempt in range(1, S3_TRANSFER_ATTEMPTS + 1):
+                try:
+                    future.result()
+                    break
+                except Exception as e:
+                    if attempt == S3_TRANSFER_ATTEMPTS or not retryable(e):
+                        raise
+                    delay = backoff_seconds(attempt)
+                    print(f"{action} of {key} failed ({str(e)}); retry {attempt} in {delay:.2f}s")
+                    time.sleep(delay)
+                    future = submit(path, key)
+
+    def upload_files(self, files: Sequence[Tuple[str, str]]) -> None:
+        """Upload (local path, key) pairs in parallel."""
+        start = time.perf_counter()
+        self._run_all(lambda path, key: self.manager.upload(path, self.bucket_name, key), files, "Upload")
+        self.uploads.record(time.perf_counter() - start, items=sum(os.path.getsize(path) for path, _ in files))
+
+    def download_files(self, files: Sequence[Tuple[str, str]]) -> None:
+        """Download (local path, key) pairs in parallel."""
+        start = time.perf_counter()
+        self._run_all(lambda path, key: self.manager.download(self.bucket_name, key, path), files, "Download")
+        self.downloads.record(time.perf_counter() - start, items=sum(os.path.getsize(path) for path, _ in files))
+
+    def stream_upload(self, path: str, key: str) -> MultipartUpload:
+        """Start uploading a file that is still being written to `path`; see `MultipartUpload`."""
+        return MultipartUpload(self, path, key)
+
+    def upload_part(self, key: str, upload_id: str, number: int, data: bytes) -> str:
+        """Upload one part of a multipart upload, restarting it with backoff; returns its ETag."""
+        for attempt in range(1, S3_TRANSFER_ATTEMPTS + 1):
+            try:
+                return self.client.upload_part(Bucket=self.bucket_name, Key=key, UploadId=upload_id,
+                                               PartNumber=number, Body=data)["ETag"]
+            except Exception as e:
+                if attempt == S3_TRANSFER_ATTEMPTS or not retryable(e):
+                    raise
+                delay = backoff_seconds(attempt)
+                print(f"Upload of part {number} of {key} failed ({str(e)}); retry {attempt} in {delay:.2f}s")
+                time.sleep(delay)
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        """The object's content, or None if it doesn't exist."""
+        try:
+            return self.client.get_object(Bucket=self.bucket_name, Key=key)["Body"].read()
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None
+            raise
+
+    def get_range(self, key: str, start: int, length: int) -> Optional[bytes]:
+        """Up to `length` bytes of the object from `start` in one ranged GET, or None if it doesn't exist."""
+        try:
+            response = self.client.get_object(Bucket=self.bucket_name, Key=key,
+                                              Range=f"bytes={start}-{start + length - 1}")
+            return response["Body"].read()
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code in ("NoSuchKey", "404"):
+                return None
+            if code == "InvalidRange":
+                return b""
+            raise
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        self.client.put_object(Bucket=self.bucket_name, Key=key, Body=data)
+
+    def list_keys(self, prefix: str) -> List[str]:
+        pages = self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket_name, Prefix=prefix)
+        return [obj["Key"] for page in pages for obj in page.get("Contents", [])]
+
+    def delete_prefix(self, prefix: str) -> None:
+        keys = self.list_keys(prefix)
+        # DeleteObjects takes up to 1000 keys per request.
+        for i in range(0, len(keys), 1000):
+            self.client.delete_objects(Bucket=self.bucket_name,
+                                       Delete={"Objects": [{"Key": key} for key in keys[i:i + 1000]]})
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return transfer_stats(self.uploads, self.downloads)
+
+
+class LocalStorage:
+    """Object storage in a local folder, one file per key; a drop-in stand-in for `S3Storage`."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.uploads = LatencyStats()
+        self.downloads = LatencyStats()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def _write(self, key: str, copy) -> None:
+        # Written aside and renamed, so readers never see a partial object (as with S3).
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+        with open(tmp_path, "wb") as f:
+            copy(f)
+        os.replace(tmp_path, path)
+
+    def upload_files(self, files: Sequence[Tuple[str, str]]) -> None:
+        with self.uploads.time(items=sum(os.path.getsize(path) for path, _ in files)):
+            for path, key in files:
+                with open(path, "rb") as source:
+                    self._write(key, lambda f: shutil.copyfileobj(source, f, CHUNK_BYTES))
+
+    def download_files(self, files: Sequence[Tuple[str, str]]) -> None:
+        with self.downloads.time(items=sum(os.path.getsize(self._path(key)) for _, key in files)):
+            for path, key in files:
+                shutil.copyfile(self._path(key), path)
+
+    def stream_upload(self, path: str, key: str) -> FileUpload:
+        return FileUpload(self, path, key)
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def get_range(self, key: str, start: int, length: int) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as f:
+                f.seek(start)
+                return f.read(length)
+        except FileNotFoundError:
+            return None
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        self._write(key, lambda f: f.write(data))
+
+    def list_keys(self, prefix: str) -> List[str]:
+        keys = []
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                if ".tmp-" in name:
+                    continue
+                key = os.path.relpath(os.path.join(root, name), self.root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+    def delete_prefix(self, prefix: str) -> None:
+        for key in self.list_keys(prefix):
+            os.remove(self._path(key))
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return transfer_stats(self.uploads, self.downloads)
@@ -0,0 +1,199 @@
+import heapq
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from operator import itemgetter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from index_store import IndexStore, load_tombstones
+from metadata_index import MetadataIndex, filtered_search, load_metadata_index, matches
+from metrics import LatencyStats
+from routing import DocumentRouter
+from sparse_index import load_bm25_index, reciprocal_rank_fusion
+
+# Threads searching a user's document indices concurrently; faiss releases the GIL while it scans.
+RETRIEVAL_FANOUT_WORKERS = int(os.getenv("RETRIEVAL_FANOUT_WORKERS", str(min(8, os.cpu_count() or 1))))
+# Hybrid retrieval: BM25 next to dense search, fused by reciprocal rank. Each ranking fetches
+# factor x k candidates before fusion.
+RETRIEVAL_HYBRID = os.getenv("RETRIEVAL_HYBRID", "1") == "1"
+HYBRID_FETCH_FACTOR = int(os.getenv("HYBRID_FETCH_FACTOR", "2"))
+HYBRID_RRF_CONSTANT = int(os.getenv("HYBRID_RRF_CONSTANT", "60"))
+# Chunks retrieved per question. Fusion recovers the keyword matches dense search misses, so
+# hybrid retrieval gets by with fewer chunks (and context tokens) than dense search alone.
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "10" if RETRIEVAL_HYBRID else "20"))
+
+
+def with_document(doc: Document, document: str) -> Document:
+    return Document(id=doc.id, page_content=doc.page_content, metadata={**doc.metadata, "document": document})
+
+
+def allowed_positions(path: str, manifest: Dict, metadata_index: Optional[MetadataIndex],
+                      filters: Optional[Dict[str, List[str]]]) -> Optional[np.ndarray]:
+    """Packed bitmap of the positions a search may return: not deleted, and matching `filters`.
+
+    None means every position is allowed.
+    """
+    total = manifest["vectors"] + manifest.get("delta_vectors", 0)
+    allowed = None
+    if manifest.get("tombstones"):
+        allowed = np.invert(load_tombstones(path, manifest["version"], total))
+    if filters:
+        selected = metadata_index.select(filters)
+        if allowed is not None:
+            selected = selected[:len(allowed)] & allowed[:len(selected)]
+        allowed = selected
+    return allowed
+
+
+class FanOutRetriever:
+    """Searches several per-document indices in parallel and merges their hits into one top-k.
+
+    Every index is built with the same embedding model, so their L2 distances are comparable
+    and each per-document (ascending) result list can be heap-merged directly. Hits carry the
+    name of the document they came from in `metadata["document"]`.
+
+    Given the question text, BM25 runs over each document's sparse index alongside the dense
+    search, and the two global rankings are fused by reciprocal rank. Scores are distances
+    either way (lower is better, as autogen's distance_threshold expects): L2 for dense search,
+    and one minus the fused score over the best possible one for hybrid.
+
+    With a `router`, a question spanning many documents searches only the ones it routes to;
+    a sample of those questions is re-run over every document in the background to measure
+    routing precision and the time routing saved.
+
+    Documents are given as manifests pinned by the caller (`IndexStore.read_manifest`), so all
+    searches of a request read the same snapshot of each index, whatever gets published meanwhile.
+    """
+
+    def __init__(self, workers: int = RETRIEVAL_FANOUT_WORKERS, router: Optional[DocumentRouter] = None):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="fanout")
+        # Audits run one at a time on their own thread, and fan out over their own pool, so their
+        # exhaustive searches never queue ahead of live ones (nor live ones ahead of them).
+        self.audit_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fanout-audit")
+        self.audit_search_executor = ThreadPoolExecutor(max_workers=max(1, workers),
+                                                        thread_name_prefix="fanout-audit-search")
+        self.router = router
+        self.latency = LatencyStats()
+
+    @staticmethod
+    def search_document(store: IndexStore, user_id: str, manifest: Dict, embeddings: Embeddings,
+                        query_vector: List[float], k: int,
+                        filters: Optional[Dict[str, List[str]]] = None) -> List[Tuple[Document, float]]:
+        """Top-k of one document, skipping deleted chunks and those not matching `filters`."""
+        document = manifest["document"]
+        vector_store = store.load(user_id, document, embeddings, manifest)
+        path = store.snapshot_path(user_id, document, manifest)
+        metadata_index = load_metadata_index(path, manifest["version"]) if filters else None
+        if filters and metadata_index is None:
+            # Pickled legacy index: there are no positions to select, so post-filter instead.
+            hits = vector_store.similarity_search_with_score_by_vector(
+                query_vector, k=k, filter=lambda metadata: matches(metadata, filters))
+        else:
+            allowed = allowed_positions(path, manifest, metadata_index, filters)
+            if allowed is None:
+                hits = vector_store.similarity_search_with_score_by_vector(query_vector, k=k)
+            else:
+                hits = filtered_search(vector_store, manifest.get("index", {}), query_vector, k, allowed)
+        return [(with_document(doc, document), score) for doc, score in hits]
+
+    @staticmethod
+    def sparse_search_document(store: IndexStore, user_id: str, manifest: Dict, embeddings: Embeddings,
+                               question: str, k: int,
+                               filters: Optional[Dict[str, List[str]]] = None) -> List[Tuple[Document, float]]:
+        """BM25 top-k of one document, best first; empty for indices written without a BM25 index."""
+        document = manifest["document"]
+        path = store.snapshot_path(user_id, document, manifest)
+        bm25_index = load_bm25_index(path, manifest["version"])
+        if bm25_index is None:
+            return []
+        metadata_index = load_metadata_index(path, manifest["version"]) if filters else None
+        if filters and metadata_index is None:
+            return []
+        allowed = allowed_positions(path, manifest, metadata_index, filters)
+        vector_store = store.load(user_id, document, embeddings, manifest)
+        return [
+            (with_document(vector_store.docstore.search(vector_store.index_to_docstore_id[position]), document), score)
+            for position, score in bm25_index.search(question, k, allowed)
+        ]
+
+    def search(self, store: IndexStore, user_id: str, manifests: Sequence[Dict], embeddings: Embeddings,
+               query_vector: List[float], k: int, filters: Optional[Dict[str, List[str]]] = None,
+               question: Optional[str] = None) -> List[Tuple[Document, float]]:
+        """Global top-k over the pinned `manifests` (or the ones the router picks among them), best first.
+
+        `filters` maps metadata fields to allowed values, e.g. {"element_type": ["Title"]}.
+        """
+        if self.router is None or not self.router.applies(manifests):
+            return self.search_all(store, user_id, manifests, embeddings, query_vector, k, filters, question)
+        start = time.perf_counter()
+        routed = self.router.route(store, user_id, manifests, query_vector)
+        hits = self.search_all(store, user_id, routed, embeddings, query_vector, k, filters, question)
+        if self.router.should_audit():
+            self.audit_executor.submit(self.audit, store, user_id, manifests, embeddings, query_vector, k,
+                                       filters, question, hits, time.perf_counter() - start)
+        return hits
+
+    def audit(self, store: IndexStore, user_id: str, manifests: Sequence[Dict], embeddings: Embeddings,
+              query_vector: List[float], k: int, filters: Optional[Dict[str, List[str]]], question: Optional[str],
+              routed_hits: List[Tuple[Document, float]], routed_seconds: float) -> None:
+        try:
+            start = time.perf_counter()
+            all_hits = self.search_all(store, user_id, manifests, embeddings, query_vector, k, filters, question,
+                                       executor=self.audit_search_executor)
+            self.router.record_audit(routed_hits, all_hits, routed_seconds, time.perf_counter() - start)
+        except Exception as e:
+            print(f"Routing audit failed for user {user_id}: {str(e)}")
+
+    def search_all(self, store: IndexStore, user_id: str, manifests: Sequence[Dict], embeddings: Embeddings,
+                   query_vector: List[float], k: int, filters: Optional[Dict[str, List[str]]] = None,
+                   question: Optional[str] = None,
+                   executor: Optional[ThreadPoolExecutor] = None) -> List[Tuple[Document, float]]:
+        """Top-k over every one of `manifests`, searched in parallel on `executor` (default: the live pool)."""
+        executor = executor or self.executor
+        hybrid = RETRIEVAL_HYBRID and bool(question)
+        fetch = k * HYBRID_FETCH_FACTOR if hybrid else k
+        tasks = [(self.search_document, query_vector, manifest) for manifest in manifests]
+        if hybrid:
+            tasks += [(self.sparse_search_document, question, manifest) for manifest in manifests]
+        with self.latency.time(items=len(manifests)):
+            if len(tasks) == 1:
+                results = [self.search_document(store, user_id, manifests[0], embeddings, query_vector, k, filters)]
+            else:
+                futures = [
+                    executor.submit(search, store, user_id, manifest, embeddings, query, fetch, filters)
+                    for search, query, manifest in tasks
+                ]
+                results = [future.result() for future in futures]
+            dense = list(islice(heapq.merge(*results[:len(manifests)], key=itemgetter(1)), fetch))
+            if not hybrid:
+                return dense
+            sparse = list(islice(heapq.merge(*results[len(manifests):], key=lambda hit: -hit[1]), fetch))
+            fused = reciprocal_rank_fusion([dense, sparse], k, HYBRID_RRF_CONSTANT,
+                                           key=lambda hit: (hit[0].metadata["document"], hit[0].id))
+            # Ranked first by both rankings.
+            best = 2 / (HYBRID_RRF_CONSTANT + 1)
+            return [(doc, 1.0 - score / best) for (doc, _), score in fused]
+
+    def stats(self) -> Dict:
+        # items are documents searched, so items_per_second is documents per second.
+        return {"search": self.latency.snapshot(), "routing": self.router.stats() if self.router else None}
+
+
+_fanout_retriever: Optional[FanOutRetriever] = None
+_fanout_retriever_lock = threading.Lock()
+
+
+def get_fanout_retriever() -> FanOutRetriever:
+    """Return the process-wide fan-out retriever and its thread pool."""
+    global _fanout_retriever
+    if _fanout_retriever is None:
+        with _fanout_retriever_lock:
+            if _fanout_retriever is None:
+                _fanout_retriever = FanOutRetriever(router=DocumentRouter())
+    return _fanout_retriever
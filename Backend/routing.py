@@ -0,0 +1,170 @@
+import os
+import random
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+
+# Per-document routing vectors, stored next to each index: row 0 is the mean of all chunk
+# vectors (kept exact across appends), the rest are k-means summaries of the chunks.
+ROUTING_FILE = "routing.npy"
+ROUTING_SUMMARY_VECTORS = int(os.getenv("ROUTING_SUMMARY_VECTORS", "8"))
+# Documents searched per question once a query spans more than this many (0 searches all).
+ROUTING_FANOUT = int(os.getenv("ROUTING_FANOUT", "8"))
+# Share of routed questions also searched exhaustively in the background to measure routing.
+ROUTING_AUDIT_RATE = float(os.getenv("ROUTING_AUDIT_RATE", "0.05"))
+ROUTING_CACHE_USERS = int(os.getenv("ROUTING_CACHE_USERS", "256"))
+
+
+def summarize(vectors: np.ndarray, summaries: int = ROUTING_SUMMARY_VECTORS) -> np.ndarray:
+    """Up to `summaries` k-means centroids of `vectors` (the vectors themselves if there are fewer)."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if len(vectors) <= summaries:
+        return vectors.copy()
+    sample = vectors
+    if len(vectors) > 256 * summaries:
+        sample = vectors[np.random.default_rng(0).choice(len(vectors), 256 * summaries, replace=False)]
+    kmeans = faiss.Kmeans(vectors.shape[1], summaries, niter=10, seed=1, min_points_per_centroid=1)
+    kmeans.train(np.ascontiguousarray(sample))
+    return kmeans.centroids
+
+
+def routing_vectors(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return np.vstack([vectors.mean(axis=0, keepdims=True), summarize(vectors)])
+
+
+def update_routing_vectors(routing: np.ndarray, count: int, added: np.ndarray) -> np.ndarray:
+    """Fold `added` vectors into routing vectors that summarised `count` vectors.
+
+    The mean stays exact; the new vectors get summaries of their own, and once a document
+    has collected more than 4x the summary budget the summaries are re-clustered.
+    """
+    added = np.asarray(added, dtype=np.float32)
+    mean = (routing[0] * count + added.sum(axis=0)) / (count + len(added))
+    summaries = np.vstack([routing[1:], summarize(added)])
+    if len(summaries) > 4 * ROUTING_SUMMARY_VECTORS:
+        summaries = summarize(summaries)
+    return np.vstack([mean[None, :], summaries])
+
+
+def write_routing(path: str, routing: np.ndarray) -> None:
+    tmp_path = os.path.join(path, ROUTING_FILE + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, routing.astype(np.float32))
+    os.replace(tmp_path, os.path.join(path, ROUTING_FILE))
+
+
+def read_routing(path: str) -> Optional[np.ndarray]:
+    try:
+        return np.load(os.path.join(path, ROUTING_FILE))
+    except FileNotFoundError:
+        return None
+
+
+class DocumentRouter:
+    """Picks the documents most likely to answer a question before their indices are searched.
+
+    Each user's routing vectors are stacked into one small matrix (normalised rows, kept in
+    memory per set of document versions), so routing is a single matrix-vector product.
+    Documents are given as the manifests a request pinned (see `IndexStore.read_manifest`). A
+    document scores as its best-matching routing row; documents without routing vectors
+    (indexed before routing existed) are always searched.
+    """
+
+    def __init__(self, width: int = ROUTING_FANOUT, audit_rate: float = ROUTING_AUDIT_RATE,
+                 cache_users: int = ROUTING_CACHE_USERS):
+        self.width = width
+        self.audit_rate = audit_rate
+        self.cache_users = cache_users
+        # (base path, user) -> (document versions, routing matrix, row owners, unrouted documents)
+        self._matrices = OrderedDict()
+        self._lock = threading.Lock()
+        self.routed = 0
+        self.documents_considered = 0
+        self.documents_searched = 0
+        self.audits = 0
+        self.precision_total = 0.0
+        self.saved_seconds_total = 0.0
+
+    def applies(self, manifests: Sequence[Dict]) -> bool:
+        return 0 < self.width < len(manifests)
+
+    def matrix(self, store, user_id: str, manifests: Sequence[Dict]) -> Tuple[np.ndarray, np.ndarray, List[Dict]]:
+        """(normalised routing rows, owning document position per row, documents without routing)."""
+        versions = tuple((manifest["document"], manifest["version"]) for manifest in manifests)
+        key = (store.base_path, user_id)
+        with self._lock:
+            cached = self._matrices.get(key)
+            if cached is not None and cached[0] == versions:
+                self._matrices.move_to_end(key)
+                return cached[1:]
+
+        rows, owners, unrouted = [], [], []
+        for position, manifest in enumerate(manifests):
+            routing = read_routing(store.snapshot_path(user_id, manifest["document"], manifest))
+            if routing is None:
+                unrouted.append(manifest)
+                continue
+            rows.append(routing)
+            owners.append(np.full(len(routing), position))
+        if rows:
+            matrix = np.vstack(rows).astype(np.float32)
+            matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+            owner = np.concatenate(owners)
+        else:
+            matrix, owner = np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.int64)
+        with self._lock:
+            self._matrices[key] = (versions, matrix, owner, unrouted)
+            self._matrices.move_to_end(key)
+            while len(self._matrices) > self.cache_users:
+                self._matrices.popitem(last=False)
+        return matrix, owner, unrouted
+
+    def route(self, store, user_id: str, manifests: Sequence[Dict], query_vector: List[float]) -> List[Dict]:
+        """The `width` documents whose routing vectors best match the question, plus unrouted ones."""
+        if not self.applies(manifests):
+            return list(manifests)
+        matrix, owner, unrouted = self.matrix(store, user_id, manifests)
+        scores = np.full(len(manifests), -np.inf, dtype=np.float32)
+        if len(matrix):
+            query = np.array(query_vector, dtype=np.float32)
+            query /= max(float(np.linalg.norm(query)), 1e-12)
+            np.maximum.at(scores, owner, matrix @ query)
+        width = min(self.width, int(np.isfinite(scores).sum()))
+        best = np.argpartition(-scores, width - 1)[:width] if width else []
+        routed = [manifests[i] for i in sorted(best, key=lambda i: -scores[i])] + unrouted
+        with self._lock:
+            self.routed += 1
+            self.documents_considered += len(manifests)
+            self.documents_searched += len(routed)
+        return routed
+
+    def should_audit(self) -> bool:
+        return random.random() < self.audit_rate
+
+    def record_audit(self, routed_hits: Sequence, all_hits: Sequence, routed_seconds: float,
+                     all_seconds: float) -> None:
+        """Compare a routed search with the exhaustive one for the same question."""
+        found = {(doc.metadata.get("document"), doc.id) for doc, _ in routed_hits}
+        expected = [(doc.metadata.get("document"), doc.id) for doc, _ in all_hits]
+        precision = sum(hit in found for hit in expected) / len(expected) if expected else 1.0
+        with self._lock:
+            self.audits += 1
+            self.precision_total += precision
+            self.saved_seconds_total += all_seconds - routed_seconds
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "width": self.width,
+                "routed_queries": self.routed,
+                "mean_documents_considered": round(self.documents_considered / self.routed, 2) if self.routed else 0.0,
+                "mean_documents_searched": round(self.documents_searched / self.routed, 2) if self.routed else 0.0,
+                "audits": self.audits,
+                # Share of the exhaustive top-k that the routed search also returned.
+                "routing_precision": round(self.precision_total / self.audits, 4) if self.audits else None,
+                "mean_time_saved_ms": round(self.saved_seconds_total / self.audits * 1000, 3) if self.audits else None,
+            }
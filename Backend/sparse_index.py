@@ -0,0 +1,150 @@
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Okapi BM25 parameters and the file holding the inverted index next to each FAISS index.
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+BM25_FILE = "bm25.npz"
+BM25_CACHE_ENTRIES = int(os.getenv("BM25_CACHE_ENTRIES", "256"))
+
+# Keeps identifiers and skill names whole: "RX-4821", "C++", "C#", "CI/CD", "node.js".
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*[+#]*")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """Inverted index of chunk texts scored with Okapi BM25.
+
+    Postings are stored CSR-style: the chunk positions and term frequencies of term `t` are
+    `positions[offsets[t]:offsets[t + 1]]` and `frequencies[...]`, with positions matching the
+    FAISS index (and so the docstore and metadata bitmaps).
+    """
+
+    def __init__(self, terms: Optional[Sequence[str]] = None, offsets: Optional[np.ndarray] = None,
+                 positions: Optional[np.ndarray] = None, frequencies: Optional[np.ndarray] = None,
+                 lengths: Optional[np.ndarray] = None):
+        self.terms = list(terms or [])
+        self.vocabulary = {term: i for i, term in enumerate(self.terms)}
+        self.offsets = offsets if offsets is not None else np.zeros(1, dtype=np.int64)
+        self.positions = positions if positions is not None else np.empty(0, dtype=np.int32)
+        self.frequencies = frequencies if frequencies is not None else np.empty(0, dtype=np.float32)
+        self.lengths = lengths if lengths is not None else np.empty(0, dtype=np.float32)
+
+    @property
+    def size(self) -> int:
+        return len(self.lengths)
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        i = self.vocabulary.get(term)
+        if i is None:
+            return self.positions[:0], self.frequencies[:0]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.positions[start:end], self.frequencies[start:end]
+
+    def extend(self, start: int, texts: Iterable[str]) -> "BM25Index":
+        """Index the texts at positions `start`, `start + 1`, ...; anything from `start` on is replaced."""
+        postings: Dict[str, List[Tuple[np.ndarray, np.ndarray]]] = defaultdict(list)
+        for term in self.terms:
+            positions, frequencies = self.postings(term)
+            keep = positions < start
+            if keep.any():
+                postings[term].append((positions[keep], frequencies[keep]))
+        lengths = list(self.lengths[:start])
+        added: Dict[str, Tuple[List[int], List[float]]] = defaultdict(lambda: ([], []))
+        for offset, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for term, count in Counter(tokens).items():
+                added[term][0].append(start + offset)
+                added[term][1].append(count)
+        for term, (positions, frequencies) in added.items():
+            postings[term].append((np.array(positions, dtype=np.int32), np.array(frequencies, dtype=np.float32)))
+
+        terms = sorted(postings)
+        merged = [
+            (np.concatenate([p for p, _ in postings[term]]), np.concatenate([f for _, f in postings[term]]))
+            for term in terms
+        ]
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(p) for p, _ in merged])
+        return BM25Index(
+            terms,
+            offsets,
+            np.concatenate([p for p, _ in merged]) if merged else np.empty(0, dtype=np.int32),
+            np.concatenate([f for _, f in merged]) if merged else np.empty(0, dtype=np.float32),
+            np.array(lengths, dtype=np.float32),
+        )
+
+    def search(self, query: str, k: int, allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Top-k (position, score) pairs for `query`, best first.
+
+        `allowed` is an optional packed little-endian bitmap (see metadata_index) of the
+        positions that may be returned.
+        """
+        if not self.size:
+            return []
+        scores = np.zeros(self.size, dtype=np.float32)
+        average_length = max(float(self.lengths.mean()), 1.0)
+        for term in set(tokenize(query)):
+            positions, frequencies = self.postings(term)
+            if not len(positions):
+                continue
+            idf = math.log(1 + (self.size - len(positions) + 0.5) / (len(positions) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[positions] / average_length)
+            scores[positions] += idf * frequencies * (BM25_K1 + 1) / (frequencies + norm)
+        if allowed is not None:
+            scores *= np.unpackbits(allowed, count=self.size, bitorder="little")
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(int(position), float(scores[position])) for position in candidates]
+
+    def save(self, path: str) -> None:
+        tmp_path = os.path.join(path, BM25_FILE + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, terms=np.array(self.terms, dtype=str), offsets=self.offsets, positions=self.positions,
+                     frequencies=self.frequencies, lengths=self.lengths)
+        os.replace(tmp_path, os.path.join(path, BM25_FILE))
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BM25Index"]:
+        try:
+            with np.load(os.path.join(path, BM25_FILE)) as data:
+                return cls(data["terms"].tolist(), data["offsets"], data["positions"], data["frequencies"],
+                           data["lengths"])
+        except FileNotFoundError:
+            return None
+
+
+@lru_cache(maxsize=BM25_CACHE_ENTRIES)
+def load_bm25_index(path: str, version: int) -> Optional[BM25Index]:
+    """BM25Index of an index folder, cached per index version."""
+    return BM25Index.load(path)
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence], k: int, constant: int = 60,
+                           key=lambda hit: hit) -> List[Tuple[object, float]]:
+    """Fuse several best-first rankings into the top-k by sum of 1 / (constant + rank).
+
+    Returns (hit, fused score) pairs, best first; a hit found by several rankings is taken
+    from the first ranking it appears in.
+    """
+    scores: Dict[object, float] = defaultdict(float)
+    first: Dict[object, object] = {}
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking, start=1):
+            identity = key(hit)
+            scores[identity] += 1.0 / (constant + rank)
+            first.setdefault(identity, hit)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [(first[identity], scores[identity]) for identity in best]
@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# The backend modules import each other as top-level modules (run from Backend/).
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def aws_credentials(monkeypatch):
+    """Fake credentials so moto never picks up (or needs) real ones."""
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SECURITY_TOKEN", "AWS_SESSION_TOKEN"):
+        monkeypatch.setenv(name, "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+from benchmarks.corpus import mixed_chunks
+from benchmarks.embedding_backends import MAX_DRIFT, cosine_drift
+from embeddings import EMBEDDING_MODEL_NAME, registry
+
+pytest.importorskip("onnxruntime")
+
+
+def encode(backend: str, texts):
+    try:
+        model = registry.get(EMBEDDING_MODEL_NAME, backend)
+    except OSError as e:
+        pytest.skip(f"{EMBEDDING_MODEL_NAME} is not available offline: {str(e)}")
+    return np.asarray(model.embed_documents(texts), dtype=np.float32)
+
+
+@pytest.mark.parametrize("backend", ["onnx", "onnx-int8"])
+def test_onnx_backend_matches_torch(backend):
+    texts = mixed_chunks(32)
+    reference = encode("torch", texts)
+
+    drift = cosine_drift(reference, encode(backend, texts))
+
+    assert drift.max() <= MAX_DRIFT
@@ -0,0 +1,21 @@
+from embedding_batching import BucketedEmbeddings
+
+
+class WordTokenizer:
+    def __call__(self, texts, add_special_tokens=True, truncation=False, max_length=None):
+        ids = [list(range(len(text.split()))) for text in texts]
+        return {"input_ids": [row[:max_length] if truncation else row for row in ids]}
+
+
+class FakeModel:
+    tokenizer = WordTokenizer()
+    max_seq_length = 384
+
+
+def test_token_lengths_stop_at_the_model_window():
+    bucketed = BucketedEmbeddings(FakeModel(), bucket_width=64)
+    texts = ["word " * 100, "word " * 400, "word " * 600]
+
+    assert bucketed.token_lengths(texts).tolist() == [100, 384, 384]
+    # Both over-long chunks are padded to the same 384 tokens, so they share a bucket.
+    assert sorted(map(sorted, bucketed.batches(texts))) == [[0], [1, 2]]
@@ -0,0 +1,137 @@
+import os
+
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import index_store
+from index_store import CURRENT_FILE, SNAPSHOT_PATTERN, IndexStore
+from retrieval import get_fanout_retriever
+
+EMBEDDINGS = DeterministicFakeEmbedding(size=16)
+
+
+def chunks(count: int, prefix: str = "chunk"):
+    return [Document(page_content=f"{prefix} {i} knows python and rust", metadata={"source": f"{prefix}.pdf"})
+            for i in range(count)]
+
+
+def search(store: IndexStore, user_id: str, question: str, k: int = 5):
+    manifests = store.list_documents(user_id)
+    return get_fanout_retriever().search(store, user_id, manifests, EMBEDDINGS, EMBEDDINGS.embed_query(question),
+                                         k, question=question)
+
+
+def test_reuploading_a_deleted_document_searches_the_new_index(tmp_path):
+    store = IndexStore(str(tmp_path))
+    store.save("alice", "resume.pdf", FAISS.from_documents(chunks(10, "old"), EMBEDDINGS))
+    assert search(store, "alice", "python")
+    store.delete("alice", "resume.pdf")
+
+    manifest = store.save("alice", "resume.pdf", FAISS.from_documents(chunks(3, "new"), EMBEDDINGS))
+
+    assert manifest["version"] == 2
+    hits = search(store, "alice", "python")
+    assert {doc.page_content for doc, _ in hits} == {f"new {i} knows python and rust" for i in range(3)}
+
+
+def contents(hits):
+    return {doc.page_content for doc, _ in hits}
+
+
+def test_readers_keep_the_snapshot_they_pinned(tmp_path):
+    store = IndexStore(str(tmp_path))
+    pinned = store.save("alice", "resume.pdf", FAISS.from_documents(chunks(5, "old"), EMBEDDINGS))
+
+    current = store.save("alice", "resume.pdf", FAISS.from_documents(chunks(3, "new"), EMBEDDINGS))
+
+    path = store.index_path("alice", "resume.pdf")
+    with open(os.path.join(path, CURRENT_FILE)) as f:
+        assert f.read() == current["snapshot"]
+    assert store.read_manifest("alice", "resume.pdf") == current
+    assert len(store.load("alice", "resume.pdf", EMBEDDINGS, pinned).index_to_docstore_id) == 5
+    assert len(store.load("alice", "resume.pdf", EMBEDDINGS).index_to_docstore_id) == 3
+
+
+def test_superseded_snapshots_are_collected_after_the_grace_period(tmp_path, monkeypatch):
+    store = IndexStore(str(tmp_path))
+    for i in range(2):
+        store.save("alice", "resume.pdf", FAISS.from_documents(chunks(3, f"v{i}"), EMBEDDINGS))
+    path = store.index_path("alice", "resume.pdf")
+    assert sorted(name for name in os.listdir(path) if SNAPSHOT_PATTERN.fullmatch(name)) == ["v000001", "v000002"]
+
+    monkeypatch.setattr(index_store, "INDEX_SNAPSHOT_GRACE_SECONDS", 0)
+    os.makedirs(os.path.join(path, ".tmp-crashed"))
+    manifest = store.save("alice", "resume.pdf", FAISS.from_documents(chunks(3, "v2"), EMBEDDINGS))
+
+    assert sorted(os.listdir(path)) == sorted([CURRENT_FILE, manifest["snapshot"]])
+
+
+def test_appended_chunks_are_searchable_before_and_after_compaction(tmp_path):
+    store = IndexStore(str(tmp_path))
+    store.save("alice", "notes.pdf", FAISS.from_documents(chunks(8, "base"), EMBEDDINGS))
+
+    manifest = store.append("alice", "notes.pdf", chunks(4, "extra"), EMBEDDINGS)
+
+    assert (manifest["vectors"], manifest["delta_vectors"]) == (8, 4)
+    assert IndexStore.needs_compaction(manifest)
+    appended = contents(search(store, "alice", "extra 2 knows python and rust", k=12))
+    assert {f"extra {i} knows python and rust" for i in range(4)} <= appended
+
+    manifest = store.compact("alice", "notes.pdf")
+
+    assert (manifest["vectors"], manifest["delta_vectors"], manifest["version"]) == (12, 0, 3)
+    assert not IndexStore.needs_compaction(manifest)
+    assert contents(search(store, "alice", "extra 2 knows python and rust", k=12)) == appended
+
+
+def test_deleted_files_are_skipped_then_purged(tmp_path):
+    store = IndexStore(str(tmp_path))
+    store.save("alice", "collection", FAISS.from_documents(chunks(6, "a") + chunks(4, "b"), EMBEDDINGS))
+    kept = {f"b {i} knows python and rust" for i in range(4)}
+
+    manifest = store.delete_file("alice", "collection", "a.pdf")
+
+    assert (manifest["vectors"], manifest["tombstones"]) == (10, 6)
+    assert contents(search(store, "alice", "python", k=10)) == kept
+    with pytest.raises(ValueError):
+        store.delete_file("alice", "collection", "a.pdf")
+
+    manifest = store.compact("alice", "collection")
+
+    assert (manifest["vectors"], manifest["tombstones"]) == (4, 0)
+    assert contents(search(store, "alice", "python", k=10)) == kept
+    assert store.delete_file("alice", "collection", "b.pdf") is None
+    assert store.read_manifest("alice", "collection") is None
+
+
+def test_document_names_cannot_collide_with_sidecar_files(tmp_path):
+    store = IndexStore(str(tmp_path))
+    names = ["resume.pdf", "resume.pdf.version", "resume.pdf.lock", "resume.pdf+version", "settings.json",
+             "+settings.json"]
+    for name in names:
+        store.save("alice", name, FAISS.from_documents(chunks(2, name), EMBEDDINGS))
+    store.set_tenant_settings("alice", compressed=False)
+
+    manifest = store.save("alice", "resume.pdf", FAISS.from_documents(chunks(2, "again"), EMBEDDINGS))
+    store.delete("alice", "resume.pdf.version")
+
+    assert manifest["version"] == 2
+    assert store.tenant_settings("alice")["compressed"] is False
+    assert sorted(m["document"] for m in store.list_documents("alice")) == sorted(set(names) - {"resume.pdf.version"})
+
+
+def test_appending_a_file_again_replaces_its_chunks(tmp_path):
+    store = IndexStore(str(tmp_path))
+    store.save("alice", "collection", FAISS.from_documents(chunks(4, "a"), EMBEDDINGS))
+    store.append("alice", "collection", chunks(3, "b"), EMBEDDINGS, replaces="b.pdf")
+
+    manifest = store.append("alice", "collection", chunks(3, "b"), EMBEDDINGS, replaces="b.pdf")
+
+    assert manifest["vectors"] + manifest["delta_vectors"] - manifest["tombstones"] == 7
+    hits = search(store, "alice", "b 1 knows python and rust", k=10)
+    assert sorted(doc.page_content for doc, _ in hits) == sorted(
+        [f"a {i} knows python and rust" for i in range(4)] + [f"b {i} knows python and rust" for i in range(3)])
+    manifest = store.compact("alice", "collection")
+    assert manifest["vectors"] == 7
@@ -0,0 +1,74 @@
+import boto3
+import pytest
+from moto import mock_aws
+
+import object_storage
+from object_storage import S3_MIN_PART_BYTES, S3Storage, file_sha256
+
+BUCKET = "bucket-t"
+
+
+@pytest.fixture
+def storage(aws_credentials):
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield S3Storage(BUCKET, client=client)
+
+
+def test_files_round_trip(storage, tmp_path):
+    sources = []
+    for i in range(3):
+        path = tmp_path / f"file-{i}"
+        path.write_bytes(bytes([i]) * (1000 + i))
+        sources.append((str(path), f"alice/doc/file-{i}"))
+
+    storage.upload_files(sources)
+    targets = [(str(tmp_path / f"copy-{i}"), key) for i, (_, key) in enumerate(sources)]
+    storage.download_files(targets)
+
+    assert sorted(storage.list_keys("alice/")) == [key for _, key in sources]
+    for (source, _), (target, _) in zip(sources, targets):
+        assert file_sha256(source) == file_sha256(target)
+
+
+def test_get_range(storage):
+    storage.put_bytes("alice/doc/data", b"0123456789")
+
+    assert storage.get_range("alice/doc/data", 2, 4) == b"2345"
+    assert storage.get_range("alice/doc/data", 8, 100) == b"89"
+    assert storage.get_range("alice/doc/data", 20, 4) == b""
+    assert storage.get_range("alice/doc/missing", 0, 4) is None
+    assert storage.get_bytes("alice/doc/missing") is None
+
+
+def test_stream_upload_sends_multipart_parts(storage, tmp_path, monkeypatch):
+    monkeypatch.setattr(object_storage, "S3_MULTIPART_CHUNK_BYTES", S3_MIN_PART_BYTES)
+    data = bytes(range(256)) * (S3_MIN_PART_BYTES * 2 // 256 + 1000)
+    upload = storage.stream_upload(str(tmp_path / "upload"), "alice/uploads/big.pdf")
+
+    for start in range(0, len(data), 1024 ** 2):
+        upload.write(data[start:start + 1024 ** 2])
+    digest = upload.complete()
+
+    assert len(upload.parts) == 3
+    assert storage.get_bytes("alice/uploads/big.pdf") == data
+    assert digest == file_sha256(str(tmp_path / "upload"))
+
+
+def test_small_stream_upload_is_one_put(storage, tmp_path):
+    upload = storage.stream_upload(str(tmp_path / "upload"), "alice/uploads/small.pdf")
+    upload.write(b"small file")
+    upload.complete()
+
+    assert upload.upload_id is None
+    assert storage.get_bytes("alice/uploads/small.pdf") == b"small file"
+
+
+def test_delete_prefix(storage):
+    for key in ("alice/a/1", "alice/a/2", "alice/b/1", "bob/a/1"):
+        storage.put_bytes(key, b"x")
+
+    storage.delete_prefix("alice/a/")
+
+    assert sorted(storage.list_keys("")) == ["alice/b/1", "bob/a/1"]
@@ -0,0 +1,58 @@
+import autogen
+from fastapi.testclient import TestClient
+from langchain_core.documents import Document
+
+import main
+import unstructured_nlp
+from index_store import IndexStore
+from tiered_store import TieredIndexStore
+from unstructured_nlp import RAGChatManager
+
+
+def test_start_chat_retrieves_context_for_the_question(monkeypatch, tmp_path):
+    monkeypatch.setattr(unstructured_nlp, "get_embeddings", lambda: None)
+    manager = RAGChatManager(vector_store_base_path=str(tmp_path))
+    monkeypatch.setattr(manager, "pin_documents", lambda user_id, documents: [{"document": "resume.pdf"}])
+    calls = []
+
+    def retrieve(user_id, manifests, filters, question, k):
+        calls.append((user_id, question, k))
+        return [(Document(page_content="Ada has five years of Rust."), 1.0)]
+
+    monkeypatch.setattr(manager, "retrieve", retrieve)
+    setup_rag_chat = manager.setup_rag_chat
+
+    def offline_setup(*args, **kwargs):
+        # Offline: the assistant answers without an LLM, and tokens are counted without tiktoken's download.
+        assistant, ragproxyagent = setup_rag_chat(*args, **kwargs)
+        assistant.register_reply([autogen.Agent, None], lambda *args, **kwargs: (True, "Five years."), position=0)
+        ragproxyagent.custom_token_count_function = lambda text, model: len(text.split())
+        return assistant, ragproxyagent
+
+    monkeypatch.setattr(manager, "setup_rag_chat", offline_setup)
+
+    result = manager.start_chat("How much Rust does Ada know?", "alice", k=5)
+
+    assert calls[0] == ("alice", "How much Rust does Ada know?", 5)
+    assert "Ada has five years of Rust." in result.chat_history[0]["content"]
+
+
+def test_manager_shares_the_stores_it_is_given(monkeypatch, tmp_path):
+    monkeypatch.setattr(unstructured_nlp, "get_embeddings", lambda: None)
+    store = IndexStore(str(tmp_path))
+    tiered = TieredIndexStore(store)
+
+    assert RAGChatManager(str(tmp_path), index_store=store, tiered_store=tiered).index_store is store
+    assert RAGChatManager(str(tmp_path), tiered_store=tiered).index_store is store
+
+
+def test_ask_rejects_unknown_filter_fields():
+    main.app.dependency_overrides[main.get_current_user] = lambda: "alice"
+    try:
+        response = TestClient(main.app).post("/ask", json={"question": "Who knows Rust?",
+                                                           "filters": {"author": ["ada"]}})
+    finally:
+        main.app.dependency_overrides.clear()
+
+    assert response.status_code == 422
+    assert "element_type" in response.text
@@ -0,0 +1,88 @@
+import threading
+import time
+
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import retrieval
+from index_store import IndexStore
+from retrieval import FanOutRetriever
+
+EMBEDDINGS = DeterministicFakeEmbedding(size=16)
+SKILLS = ["python", "rust", "kubernetes", "terraform", "postgres", "react"]
+
+
+@pytest.mark.parametrize("hybrid", [True, False])
+def test_scores_are_distances_best_first(tmp_path, monkeypatch, hybrid):
+    monkeypatch.setattr(retrieval, "RETRIEVAL_HYBRID", hybrid)
+    store = IndexStore(str(tmp_path))
+    for document in ("a.pdf", "b.pdf"):
+        chunks = [Document(page_content=f"{document} lists {skill}") for skill in SKILLS]
+        store.save("alice", document, FAISS.from_documents(chunks, EMBEDDINGS))
+    question = "who lists rust"
+
+    hits = FanOutRetriever(workers=2).search(store, "alice", store.list_documents("alice"), EMBEDDINGS,
+                                             EMBEDDINGS.embed_query(question), 4, question=question)
+
+    scores = [score for _, score in hits]
+    assert len(hits) == 4
+    assert scores == sorted(scores)
+    assert all(score >= 0 for score in scores)
+
+
+class AlwaysAuditRouter:
+    """Routes every question to a.pdf and audits every one."""
+
+    def __init__(self):
+        self.audited = threading.Event()
+
+    def applies(self, manifests):
+        return True
+
+    def route(self, store, user_id, manifests, query_vector):
+        return [manifest for manifest in manifests if manifest["document"] == "a.pdf"]
+
+    def should_audit(self):
+        return True
+
+    def record_audit(self, routed_hits, all_hits, routed_seconds, all_seconds):
+        self.audited.set()
+
+
+def slow_unless_routed(search):
+    """Wrap a per-document search so any document but the routed one (i.e. the audit's) is slow."""
+    def wrapper(store, user_id, manifest, *args):
+        if manifest["document"] != "a.pdf":
+            time.sleep(0.3)
+        return search(store, user_id, manifest, *args)
+    return staticmethod(wrapper)
+
+
+class SlowAuditRetriever(FanOutRetriever):
+    search_document = slow_unless_routed(FanOutRetriever.search_document)
+    sparse_search_document = slow_unless_routed(FanOutRetriever.sparse_search_document)
+
+
+def test_audits_do_not_delay_live_searches(tmp_path, monkeypatch):
+    monkeypatch.setattr(retrieval, "RETRIEVAL_HYBRID", True)
+    store = IndexStore(str(tmp_path))
+    for document in ("a.pdf", "b.pdf", "c.pdf", "d.pdf"):
+        chunks = [Document(page_content=f"{document} lists {skill}") for skill in SKILLS]
+        store.save("alice", document, FAISS.from_documents(chunks, EMBEDDINGS))
+    router = AlwaysAuditRouter()
+    retriever = SlowAuditRetriever(workers=2, router=router)
+    manifests = store.list_documents("alice")
+    question = "who lists rust"
+    query_vector = EMBEDDINGS.embed_query(question)
+
+    retriever.search(store, "alice", manifests, EMBEDDINGS, query_vector, 4, question=question)
+    time.sleep(0.05)  # let the audit start its exhaustive search
+    start = time.perf_counter()
+    hits = retriever.search(store, "alice", manifests, EMBEDDINGS, query_vector, 4, question=question)
+    seconds = time.perf_counter() - start
+
+    assert hits and {doc.metadata["document"] for doc, _ in hits} == {"a.pdf"}
+    assert seconds < 0.25
+    assert router.audited.wait(5)
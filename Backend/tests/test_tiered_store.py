@@ -0,0 +1,131 @@
+import boto3
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from moto import mock_aws
+
+import tiered_store
+from bundle import BUNDLE_FILE
+from index_store import IndexStore
+from object_storage import LocalStorage, S3Storage
+from tiered_store import TieredIndexStore
+
+EMBEDDINGS = DeterministicFakeEmbedding(size=16)
+
+
+def save(store: IndexStore, user_id: str, document: str, count: int = 5):
+    chunks = [Document(page_content=f"{document} chunk {i}") for i in range(count)]
+    return store.save(user_id, document, FAISS.from_documents(chunks, EMBEDDINGS))
+
+
+class CountingStorage(LocalStorage):
+    def __init__(self, root: str):
+        super().__init__(root)
+        self.listings = 0
+
+    def list_keys(self, prefix: str):
+        # Only listings of a user's whole prefix, not a push or delete tidying up one document.
+        self.listings += prefix.count("/") == 1
+        return super().list_keys(prefix)
+
+
+def test_listing_documents_reuses_the_remote_listing(tmp_path):
+    storage = CountingStorage(str(tmp_path / "remote"))
+    tiered = TieredIndexStore(IndexStore(str(tmp_path / "local")), storage)
+    save(tiered.store, "alice", "a.pdf")
+    tiered.push("alice", "a.pdf")
+    listings = storage.listings
+
+    assert tiered.list_documents("alice") == ["a.pdf"]
+    save(tiered.store, "alice", "b.pdf")
+    tiered.push("alice", "b.pdf")
+    assert sorted(tiered.list_documents("alice")) == ["a.pdf", "b.pdf"]
+    tiered.delete("alice", "a.pdf")
+    assert tiered.list_documents("alice") == ["b.pdf"]
+    assert storage.listings - listings == 1
+
+
+def test_ensure_local_keeps_the_document_it_pulled(tmp_path, monkeypatch):
+    monkeypatch.setattr(tiered_store, "INDEX_SNAPSHOT_GRACE_SECONDS", 0)
+    storage = LocalStorage(str(tmp_path / "remote"))
+    save(IndexStore(str(tmp_path / "writer")), "alice", "a.pdf")
+    TieredIndexStore(IndexStore(str(tmp_path / "writer")), storage).push("alice", "a.pdf")
+    tiered = TieredIndexStore(IndexStore(str(tmp_path / "local")), storage, disk_budget_bytes=1)
+
+    manifest = tiered.ensure_local("alice", "a.pdf")
+
+    assert manifest is not None
+    assert tiered.store.read_manifest("alice", "a.pdf") == manifest
+
+
+def test_delete_finds_a_document_only_bundled_in_object_storage(tmp_path):
+    storage = LocalStorage(str(tmp_path / "remote"))
+    save(IndexStore(str(tmp_path / "writer")), "alice", "a.pdf")
+    TieredIndexStore(IndexStore(str(tmp_path / "writer")), storage, bundle=True).push("alice", "a.pdf")
+    tiered = TieredIndexStore(IndexStore(str(tmp_path / "local")), storage)
+
+    tiered.delete("alice", "a.pdf")
+
+    assert storage.list_keys("alice/") == []
+
+
+@pytest.fixture(params=["local", "s3"])
+def storage(request, tmp_path):
+    if request.param == "local":
+        yield LocalStorage(str(tmp_path / "remote"))
+        return
+    request.getfixturevalue("aws_credentials")
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="bucket-t")
+        yield S3Storage("bucket-t", client=client)
+
+
+def pushed(tmp_path, storage, bundle: bool):
+    writer = TieredIndexStore(IndexStore(str(tmp_path / "writer")), storage, bundle=bundle)
+    save(writer.store, "alice", "a.pdf", count=7)
+    return writer.push("alice", "a.pdf")
+
+
+@pytest.mark.parametrize("bundle", [True, False], ids=["bundle", "files"])
+def test_pull_restores_the_pushed_snapshot(tmp_path, storage, bundle):
+    manifest = pushed(tmp_path, storage, bundle)
+    reader = TieredIndexStore(IndexStore(str(tmp_path / "reader")), storage)
+
+    restored = reader.pull("alice", "a.pdf")
+
+    assert restored["version"] == manifest["version"]
+    assert reader.is_synced("alice", "a.pdf")
+    vector_store = reader.store.load("alice", "a.pdf", EMBEDDINGS, restored)
+    hits = vector_store.similarity_search("a.pdf chunk 3", k=1)
+    assert hits[0].page_content == "a.pdf chunk 3"
+    assert reader.list_documents("alice") == ["a.pdf"]
+
+
+@pytest.mark.parametrize("bundle", [True, False], ids=["bundle", "files"])
+def test_pull_refuses_a_corrupt_upload(tmp_path, storage, bundle):
+    pushed(tmp_path, storage, bundle)
+    prefix = TieredIndexStore.remote_prefix("alice", "a.pdf")
+    key = f"{prefix}/{BUNDLE_FILE}" if bundle else f"{prefix}/index.faiss"
+    data = bytearray(storage.get_bytes(key))
+    data[len(data) // 2] ^= 0xFF
+    storage.put_bytes(key, bytes(data))
+    reader = TieredIndexStore(IndexStore(str(tmp_path / "reader")), storage)
+
+    with pytest.raises(IOError):
+        reader.pull("alice", "a.pdf")
+
+    assert reader.store.read_manifest("alice", "a.pdf") is None
+
+
+def test_document_names_cannot_collide_with_sync_markers(tmp_path):
+    tiered = TieredIndexStore(IndexStore(str(tmp_path / "local")), LocalStorage(str(tmp_path / "remote")))
+    for name in ("a.pdf", "a.pdf.synced", "a.pdf+synced"):
+        save(tiered.store, "alice", name)
+    tiered.push("alice", "a.pdf")
+
+    assert tiered.is_synced("alice", "a.pdf")
+    assert not tiered.is_synced("alice", "a.pdf.synced")
+    assert sorted(document for _, _, document, _ in tiered.local_documents()) == [
+        "a.pdf", "a.pdf+synced", "a.pdf.synced"]
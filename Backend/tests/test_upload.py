@@ -0,0 +1,156 @@
+import asyncio
+from functools import partial
+from types import SimpleNamespace
+
+import diskcache
+import pytest
+from fastapi.testclient import TestClient
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import main
+from embedding_cache import CachedEmbeddings
+from index_store import IndexStore
+from object_storage import FileUpload
+from tiered_store import TieredIndexStore
+
+
+def where() -> str:
+    try:
+        asyncio.get_running_loop()
+        return "event loop"
+    except RuntimeError:
+        return "thread"
+
+
+class RecordingStorage:
+    """Storage whose uploads record how they were driven instead of uploading.
+
+    Completing an upload fails unless `completes`, which stops the request before indexing.
+    """
+
+    def __init__(self, completes: bool = False):
+        self.completes = completes
+        self.uploads = []
+
+    def stream_upload(self, path: str, key: str):
+        upload = RecordingUpload(self, path, key)
+        self.uploads.append(upload)
+        return upload
+
+
+class RecordingUpload(FileUpload):
+    def __init__(self, storage, path: str, key: str):
+        super().__init__(storage, path, key)
+        self.calls = []
+
+    def _record(self, name: str) -> None:
+        self.calls.append((name, where()))
+
+    def write(self, chunk: bytes) -> None:
+        self._record("write")
+        super().write(chunk)
+
+    def complete(self) -> str:
+        self._record("complete")
+        if not self.storage.completes:
+            raise RuntimeError("stop before indexing")
+        self.file.close()
+        return self.digest.hexdigest()
+
+    def abort(self) -> None:
+        self._record("abort")
+        super().abort()
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "UPLOADS_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "file_storage", RecordingStorage())
+    main.app.dependency_overrides[main.get_current_user] = lambda: "alice"
+    yield TestClient(main.app)
+    main.app.dependency_overrides.clear()
+
+
+def test_upload_over_the_limit_is_refused_before_the_body_is_read(client, monkeypatch):
+    monkeypatch.setattr(main, "MAX_UPLOAD_BYTES", 1024)
+    response = client.post("/upload", files={"file": ("big.txt", b"x" * (main.UPLOAD_FORM_OVERHEAD_BYTES + 2048))})
+
+    assert response.status_code == 413
+    assert main.file_storage.uploads == []
+
+
+def test_upload_growing_past_the_limit_is_aborted(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "MAX_UPLOAD_BYTES", 1024)
+    monkeypatch.setattr(main, "UPLOAD_CHUNK_BYTES", 512)
+    response = client.post("/upload", files={"file": ("big.txt", b"x" * 4096)})
+
+    assert response.status_code == 413
+    [upload] = main.file_storage.uploads
+    assert upload.calls[-1][0] == "abort"
+    assert list((tmp_path / "alice").iterdir()) == []
+
+
+def test_upload_writes_run_off_the_event_loop(client, monkeypatch):
+    monkeypatch.setattr(main, "UPLOAD_CHUNK_BYTES", 512)
+    client.post("/upload", files={"file": ("notes.txt", b"x" * 2048)})
+
+    [upload] = main.file_storage.uploads
+    assert [name for name, _ in upload.calls] == ["write"] * 4 + ["complete", "abort"]
+    assert {where for _, where in upload.calls} == {"thread"}
+
+
+class RecordingProcessor:
+    """Stands in for DocumentProcessor; records where parsing ran and extracts nothing."""
+
+    calls = []
+
+    def __init__(self, uploads_dir: str):
+        pass
+
+    def process_file(self, path: str):
+        self.calls.append(where())
+        return []
+
+
+def test_upload_processing_runs_off_the_event_loop(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "file_storage", RecordingStorage(completes=True))
+    monkeypatch.setattr(main, "DocumentProcessor", RecordingProcessor)
+    monkeypatch.setattr(RecordingProcessor, "calls", [])
+    response = client.post("/upload", files={"file": ("notes.txt", b"x" * 2048)})
+
+    assert response.status_code == 500
+    assert RecordingProcessor.calls == ["thread"]
+    assert list((tmp_path / "alice").iterdir()) == []
+
+
+class ChunkingProcessor:
+    """Stands in for DocumentProcessor; every uploaded file yields the same three chunks."""
+
+    def __init__(self, uploads_dir: str):
+        pass
+
+    def process_file(self, path: str):
+        return [Document(page_content=f"section {i} of the handbook", metadata={"source": path}) for i in range(3)]
+
+    def create_chunks(self, documents):
+        return documents
+
+
+def test_uploading_a_file_into_a_collection_again_replaces_it(client, monkeypatch, tmp_path):
+    store = IndexStore(str(tmp_path / "vectordb"))
+    monkeypatch.setattr(main, "file_storage", RecordingStorage(completes=True))
+    monkeypatch.setattr(main, "DocumentProcessor", ChunkingProcessor)
+    monkeypatch.setattr(main, "get_embeddings", lambda: SimpleNamespace(model_id="fake"))
+    monkeypatch.setattr(main, "ingestion_embeddings", lambda model: DeterministicFakeEmbedding(size=16))
+    cache = diskcache.Cache(str(tmp_path / "cache"))
+    monkeypatch.setattr(main, "CachedEmbeddings", partial(CachedEmbeddings, cache=cache))
+    monkeypatch.setattr(main, "index_store", store)
+    monkeypatch.setattr(main, "tiered_store", TieredIndexStore(store))
+
+    for _ in range(2):
+        response = client.post("/upload", files={"file": ("handbook.pdf", b"%PDF")}, data={"collection": "hr"})
+        assert response.status_code == 200
+
+    manifest = store.read_manifest("alice", "hr")
+    assert manifest["vectors"] + manifest.get("delta_vectors", 0) - manifest.get("tombstones", 0) == 3
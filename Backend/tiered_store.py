@@ -0,0 +1,371 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from functools import partial
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import unquote
+
+from bundle import BUNDLE_FILE, BUNDLE_VECTOR_ENCODING, extract_bundle, read_header, write_bundle
+from index_store import (
+    CURRENT_FILE,
+    INDEX_SNAPSHOT_GRACE_SECONDS,
+    MANIFEST_FILE,
+    RETIRED_SUFFIX,
+    SIDECAR_MARK,
+    IndexStore,
+    index_cache,
+)
+from metrics import LatencyStats
+from object_storage import file_sha256
+
+# Local disk budget for index folders; least recently used documents already in object
+# storage are evicted past it (0 disables eviction).
+INDEX_DISK_BUDGET_BYTES = int(os.getenv("INDEX_DISK_BUDGET_BYTES", str(20 * 1024 ** 3)))
+# Push each snapshot as one compressed bundle object (see bundle.py) rather than loose files.
+INDEX_BUNDLE = os.getenv("INDEX_BUNDLE", "1") == "1"
+# Loose files layout: uploaded last, lists the snapshot's files with their sizes and SHA-256,
+# and marks the upload complete.
+CHECKSUMS_FILE = "checksums.json"
+# Next to each document folder locally: the snapshot last uploaded, so the folder may be evicted.
+SYNCED_SUFFIX = SIDECAR_MARK + "synced"
+# Listing a user's documents in object storage is cached this long, so questions don't each
+# wait on a LIST; pushes and deletes through this store update the cached listing.
+REMOTE_LISTING_TTL_SECONDS = float(os.getenv("REMOTE_LISTING_TTL_SECONDS", "300"))
+
+
+def folder_bytes(path: str) -> int:
+    """Disk bytes under `path`, counting hard-linked files (shared between snapshots) once."""
+    seen, total = set(), 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            if (stat.st_dev, stat.st_ino) not in seen:
+                seen.add((stat.st_dev, stat.st_ino))
+                total += stat.st_size
+    return total
+
+
+class TieredIndexStore:
+    """Indices across three tiers: memory, local disk, and object storage as the source of truth.
+
+    Loaded indices stay in `index_cache`; `IndexStore` folders on local disk are bounded by
+    `disk_budget_bytes`, evicting least recently used documents; every published snapshot is
+    pushed to `storage` under {user}/{document}/vector_store/, as a single bundle object or as
+    loose files plus checksums.json. A document missing locally is pulled back on first use
+    and checked against the checksums uploaded with it; pulls read either layout.
+
+    `storage` is an `S3Storage`, or a `LocalStorage` stand-in; None keeps indices local only.
+    """
+
+    def __init__(self, store: IndexStore, storage=None, disk_budget_bytes: int = INDEX_DISK_BUDGET_BYTES,
+                 bundle: bool = INDEX_BUNDLE, vector_encoding: str = BUNDLE_VECTOR_ENCODING):
+        self.store = store
+        self.storage = storage
+        self.disk_budget_bytes = disk_budget_bytes
+        self.bundle = bundle
+        self.vector_encoding = vector_encoding
+        self.hydrations = LatencyStats()
+        self._lock = threading.Lock()
+        self.hydrated_bytes = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self._remote_listings: Dict[str, Tuple[float, List[str]]] = {}
+
+    @staticmethod
+    def remote_prefix(user_id: str, document: str) -> str:
+        return f"{user_id}/{document}/vector_store"
+
+    def ensure_local(self, user_id: str, document: str) -> Optional[Dict]:
+        """Manifest of the document's current snapshot, downloading it first if it isn't on local disk.
+
+        None if the document exists in neither tier.
+        """
+        manifest = self.store.read_manifest(user_id, document)
+        pulled = manifest is None and self.storage is not None
+        if pulled:
+            manifest = self.pull(user_id, document)
+        if manifest is None:
+            return None
+        # The folder's mtime is its last use, for LRU eviction.
+        os.utime(self.store.index_path(user_id, document))
+        if pulled:
+            self.evict(keep=[(user_id, document)])
+        return manifest
+
+    def list_documents(self, user_id: str) -> List[str]:
+        """Names of the user's documents, local or only in object storage."""
+        documents = [manifest["document"] for manifest in self.store.list_documents(user_id)]
+        return list(dict.fromkeys(documents + self.remote_documents(user_id)))
+
+    def remote_documents(self, user_id: str) -> List[str]:
+        """Names of the user's documents in object storage, listed at most every REMOTE_LISTING_TTL_SECONDS."""
+        if self.storage is None:
+            return []
+        with self._lock:
+            expires, documents = self._remote_listings.get(user_id, (0.0, []))
+        if expires > time.monotonic():
+            return list(documents)
+        documents = []
+        for key in self.storage.list_keys(f"{user_id}/"):
+            for marker in (BUNDLE_FILE, CHECKSUMS_FILE):
+                suffix = f"/vector_store/{marker}"
+                if key.endswith(suffix):
+                    documents.append(key[len(user_id) + 1:-len(suffix)])
+        documents = list(dict.fromkeys(documents))
+        with self._lock:
+            self._remote_listings[user_id] = (time.monotonic() + REMOTE_LISTING_TTL_SECONDS, documents)
+        return list(documents)
+
+    def _update_listing(self, user_id: str, document: str, present: bool) -> None:
+        with self._lock:
+            if user_id not in self._remote_listings:
+                return
+            expires, documents = self._remote_listings[user_id]
+            documents = [name for name in documents if name != document] + ([document] if present else [])
+            self._remote_listings[user_id] = (expires, documents)
+
+    def push(self, user_id: str, document: str) -> Optional[Dict]:
+        """Upload the document's current snapshot; returns its manifest, None if nothing was uploaded.
+
+        Holds the document lock so no append changes the shared append log or docstore mid-upload.
+        """
+        if self.storage is None:
+            return None
+        prefix = self.remote_prefix(user_id, document)
+        with self.store.lock(user_id, document):
+            manifest = self.store.read_manifest(user_id, document)
+            if manifest is None:
+                return None
+            path = self.store.snapshot_path(user_id, document, manifest)
+            start = time.perf_counter()
+            if self.bundle:
+                size = self._push_bundle(prefix, path, self.store.index_path(user_id, document))
+            else:
+                size = self._push_files(prefix, path, manifest)
+            seconds = time.perf_counter() - start
+            self._write_synced(user_id, document, manifest)
+        print(f"Uploaded index {user_id}/{document} v{manifest['version']}: {size} bytes in {seconds:.2f}s "
+              f"({size / max(seconds, 1e-9) / 1024 ** 2:.1f} MiB/s)")
+        self._update_listing(user_id, document, True)
+        self.evict(keep=[(user_id, document)])
+        return manifest
+
+    def _push_bundle(self, prefix: str, path: str, index_path: str) -> int:
+        bundle_path = f"{index_path}{SIDECAR_MARK}bundle-{uuid.uuid4().hex}"
+        try:
+            write_bundle(path, bundle_path, self.vector_encoding)
+            self.storage.upload_files([(bundle_path, f"{prefix}/{BUNDLE_FILE}")])
+            size = os.path.getsize(bundle_path)
+        finally:
+            if os.path.exists(bundle_path):
+                os.remove(bundle_path)
+        # Pulls prefer the bundle, so loose files left from an earlier push are only clutter;
+        # their checksums go first so no reader takes a half-deleted copy as complete.
+        loose = [key for key in self.storage.list_keys(f"{prefix}/") if key != f"{prefix}/{BUNDLE_FILE}"]
+        for key in sorted(loose, key=lambda key: not key.endswith(f"/{CHECKSUMS_FILE}")):
+            self.storage.delete_prefix(key)
+        return size
+
+    def _push_files(self, prefix: str, path: str, manifest: Dict) -> int:
+        names = [
+            name for name in sorted(os.listdir(path))
+            if name != CURRENT_FILE and not name.endswith(".tmp") and os.path.isfile(os.path.join(path, name))
+        ]
+        files = {
+            name: {"size": os.path.getsize(os.path.join(path, name)), "sha256": file_sha256(os.path.join(path, name))}
+            for name in names
+        }
+        self.storage.upload_files([(os.path.join(path, name), f"{prefix}/{name}") for name in names])
+        checksums = {"version": manifest["version"], "files": files}
+        self.storage.put_bytes(f"{prefix}/{CHECKSUMS_FILE}", json.dumps(checksums).encode())
+        # Pulls prefer a bundle, so one left from an earlier push would shadow this upload.
+        self.storage.delete_prefix(f"{prefix}/{BUNDLE_FILE}")
+        return sum(expected["size"] for expected in files.values())
+
+    def remote_header(self, user_id: str, document: str) -> Optional[Dict]:
+        """Header of the document's uploaded bundle (manifest, sections, checksums), read with one
+        ranged GET; None if it has no bundle."""
+        key = f"{self.remote_prefix(user_id, document)}/{BUNDLE_FILE}"
+
+        def read_range(start: int, length: int) -> bytes:
+            data = self.storage.get_range(key, start, length)
+            if data is None:
+                raise FileNotFoundError(key)
+            return data
+
+        try:
+            return read_header(read_range)[0]
+        except FileNotFoundError:
+            return None
+
+    def pull(self, user_id: str, document: str) -> Optional[Dict]:
+        """Download the document's last uploaded snapshot and publish it locally; None if there is none."""
+        prefix = self.remote_prefix(user_id, document)
+        header = self.remote_header(user_id, document)
+        if header is not None:
+            version = header["manifest"]["version"]
+            size = sum(entry["length"] for entry in header["entries"])
+            fetch = partial(self._fetch_bundle, f"{prefix}/{BUNDLE_FILE}")
+        else:
+            data = self.storage.get_bytes(f"{prefix}/{CHECKSUMS_FILE}")
+            if data is None:
+                return None
+            checksums = json.loads(data)
+            version = checksums["version"]
+            size = sum(expected["size"] for expected in checksums["files"].values())
+            fetch = partial(self._fetch_files, prefix, checksums)
+
+        start = time.perf_counter()
+        manifest = self.store.restore(user_id, document, version, fetch)
+        self.hydrations.record(time.perf_counter() - start, items=size)
+        if manifest["version"] == version:
+            self._write_synced(user_id, document, manifest)
+        with self._lock:
+            self.hydrated_bytes += size
+        print(f"Downloaded index {user_id}/{document} v{manifest['version']} ({size} bytes)")
+        return manifest
+
+    def _fetch_bundle(self, key: str, staging: str) -> Dict:
+        bundle_path = os.path.join(staging, BUNDLE_FILE)
+        # One retry: a mismatch is far more likely a bad transfer than a bad object.
+        for attempt in range(2):
+            self.storage.download_files([(bundle_path, key)])
+            try:
+                header = extract_bundle(bundle_path, staging)
+                break
+            except IOError as e:
+                if attempt:
+                    raise
+                print(f"Bad index bundle download {key} ({str(e)}); retrying")
+        os.remove(bundle_path)
+        return header["manifest"]
+
+    def _fetch_files(self, prefix: str, checksums: Dict, staging: str) -> Dict:
+        names = list(checksums["files"])
+        for attempt in range(2):
+            self.storage.download_files([(os.path.join(staging, name), f"{prefix}/{name}") for name in names])
+            names = [name for name in names if not self._verify(os.path.join(staging, name), checksums["files"][name])]
+            if not names:
+                break
+            print(f"Checksum mismatch downloading {', '.join(names)} of {prefix} (attempt {attempt + 1})")
+        else:
+            raise IOError(f"Checksum mismatch for {', '.join(names)} of {prefix}")
+        with open(os.path.join(staging, MANIFEST_FILE)) as f:
+            return json.load(f)
+
+    @staticmethod
+    def _verify(path: str, expected: Dict) -> bool:
+        return os.path.getsize(path) == expected["size"] and file_sha256(path) == expected["sha256"]
+
+    def _synced_path(self, user_id: str, document: str) -> str:
+        return self.store.index_path(user_id, document) + SYNCED_SUFFIX
+
+    def _write_synced(self, user_id: str, document: str, manifest: Dict) -> None:
+        tmp_path = f"{self._synced_path(user_id, document)}.tmp-{uuid.uuid4().hex}"
+        with open(tmp_path, "w") as f:
+            f.write(str(manifest["version"]))
+        os.replace(tmp_path, self._synced_path(user_id, document))
+
+    def is_synced(self, user_id: str, document: str) -> bool:
+        """Whether object storage holds the document's current snapshot, so its local copy can be evicted."""
+        manifest = self.store.read_manifest(user_id, document)
+        try:
+            with open(self._synced_path(user_id, document)) as f:
+                return manifest is not None and int(f.read()) == manifest["version"]
+        except (FileNotFoundError, ValueError):
+            return False
+
+    def local_documents(self) -> List[Tuple[float, str, str, int]]:
+        """(last used, user, document, disk bytes) of every local document folder."""
+        documents = []
+        if not os.path.isdir(self.store.base_path):
+            return documents
+        for user_entry in os.listdir(self.store.base_path):
+            user_path = os.path.join(self.store.base_path, user_entry)
+            if not os.path.isdir(user_path):
+                continue
+            for entry in os.listdir(user_path):
+                path = os.path.join(user_path, entry)
+                if SIDECAR_MARK in entry or not os.path.isdir(path):
+                    continue
+                try:
+                    documents.append((os.path.getmtime(path), unquote(user_entry), unquote(entry), folder_bytes(path)))
+                except FileNotFoundError:
+                    continue
+        return documents
+
+    def evict(self, keep: Sequence[Tuple[str, str]] = ()) -> int:
+        """Delete local copies, least recently used first, until the disk tier fits its budget.
+
+        Only documents whose current snapshot is in object storage and that weren't used
+        within INDEX_SNAPSHOT_GRACE_SECONDS (so no request can still be reading them) are
+        evicted, never the (user, document) pairs in `keep`. Returns the bytes freed.
+        """
+        if self.storage is None or not self.disk_budget_bytes:
+            return 0
+        documents = sorted(self.local_documents())
+        total = sum(size for _, _, _, size in documents)
+        freed = 0
+        now = time.time()
+        for used, user_id, document, size in documents:
+            if total - freed <= self.disk_budget_bytes or now - used < INDEX_SNAPSHOT_GRACE_SECONDS:
+                break
+            if (user_id, document) in keep:
+                continue
+            path = self.store.index_path(user_id, document)
+            with self.store.lock(user_id, document):
+                if not self.is_synced(user_id, document) or os.path.getmtime(path) != used:
+                    continue
+                retired = f"{path}{RETIRED_SUFFIX}{uuid.uuid4().hex}"
+                os.rename(path, retired)
+            shutil.rmtree(retired, ignore_errors=True)
+            index_cache.invalidate(self.store.base_path, user_id, document)
+            freed += size
+            with self._lock:
+                self.evictions += 1
+                self.evicted_bytes += size
+            print(f"Evicted local index {user_id}/{document} ({size} bytes)")
+        return freed
+
+    def delete_remote(self, user_id: str, document: str) -> bool:
+        """Delete a document's object storage copy; whether there was a complete one."""
+        if os.path.exists(self._synced_path(user_id, document)):
+            os.remove(self._synced_path(user_id, document))
+        if self.storage is None:
+            return False
+        prefix = self.remote_prefix(user_id, document)
+        found = any(self.storage.get_range(f"{prefix}/{marker}", 0, 1) is not None
+                    for marker in (BUNDLE_FILE, CHECKSUMS_FILE))
+        # Also clears files uploaded before checksums existed.
+        self.storage.delete_prefix(prefix + "/")
+        self._update_listing(user_id, document, False)
+        return found
+
+    def delete(self, user_id: str, document: str) -> None:
+        """Delete a document from every tier; ValueError if it exists in none."""
+        found = True
+        try:
+            self.store.delete(user_id, document)
+        except ValueError:
+            found = False
+        if not self.delete_remote(user_id, document) and not found:
+            raise ValueError(f"Vector store not found for user {user_id} and file {document}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hydrated, evictions, evicted = self.hydrated_bytes, self.evictions, self.evicted_bytes
+        # items are bytes downloaded, so items_per_second is the download rate.
+        return {
+            "hydrations": self.hydrations.snapshot(),
+            "transfers": self.storage.stats() if self.storage is not None else None,
+            "hydrated_bytes": hydrated,
+            "evictions": evictions,
+            "evicted_bytes": evicted,
+            "disk_budget_bytes": self.disk_budget_bytes,
+        }
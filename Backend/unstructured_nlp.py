@@ -1,5 +1,5 @@
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional, Tuple
 from pathlib import Path
 import filetype
 from unstructured.partition.auto import partition
@@ -11,8 +11,14 @@ import os
 import autogen
 from autogen.agentchat.contrib.retrieve_user_proxy_agent import RetrieveUserProxyAgent
 from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
-import shutil
+from embeddings import get_embeddings
+from embedding_batching import get_query_batcher
+from embedding_cache import query_cache
+from index_store import IndexStore
+from tiered_store import TieredIndexStore
+from retrieval import RETRIEVAL_TOP_K, get_fanout_retriever
+from metadata_index import METADATA_INDEX_FIELDS
+from functools import partial
 
 class DocumentProcessor:
     """Handles document processing using unstructured.io and prepares them for vectorization."""
@@ -98,33 +104,77 @@ class DocumentProcessor:
         return splits
 
 
+class VectorStoreRetrieveUserProxyAgent(RetrieveUserProxyAgent):
+    """RetrieveUserProxyAgent that retrieves through our own search function instead of chromadb."""
+
+    def __init__(self, search_fn: Callable[[str, int], List[Tuple[Document, float]]], **kwargs):
+        super().__init__(**kwargs)
+        self._search_fn = search_fn
+
+    def retrieve_docs(self, problem: str, n_results: int = RETRIEVAL_TOP_K, search_string: str = ""):
+        """Run the search and store the hits in the `QueryResults` shape autogen expects."""
+        hits = self._search_fn(problem, n_results)
+        if search_string:
+            hits = [(doc, score) for doc, score in hits if search_string in doc.page_content]
+
+        self._search_string = search_string
+        self._results = [[
+            ({"id": doc.id or f"doc_{i}", "content": doc.page_content, "metadata": doc.metadata}, float(score))
+            for i, (doc, score) in enumerate(hits)
+        ]]
+
+
 class RAGChatManager:
-    def __init__(self, vector_store_base_path: str = "vectordb", config_list: list = None):
+    def __init__(self, vector_store_base_path: str = "vectordb", config_list: list = None,
+                 tiered_store: Optional[TieredIndexStore] = None, index_store: Optional[IndexStore] = None):
         self.vector_store_base_path = vector_store_base_path
+        # Share the application's store (and the tiered store's) rather than opening another.
+        self.index_store = index_store or (tiered_store.store if tiered_store else IndexStore(vector_store_base_path))
+        # Pulls indices missing from local disk back from object storage; local only by default.
+        self.tiered_store = tiered_store or TieredIndexStore(self.index_store)
         self.config_list = config_list or [
             {
                 'model': 'gpt-3.5-turbo',
                 'api_key': "your-api-key-here",
             }
         ]
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-mpnet-base-v2",
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
+        self.embeddings = get_embeddings()
 
     def load_vector_store(self, user_id: str, filename: str) -> FAISS:
         """Load the vector store for a specific user and file."""
-        vector_store_path = os.path.join(self.vector_store_base_path, user_id, filename)
-        if not os.path.exists(vector_store_path):
+        manifest = self.tiered_store.ensure_local(user_id, filename)
+        if manifest is None:
             raise ValueError(f"Vector store not found for user {user_id} and file {filename}")
-        
-        return FAISS.load_local(vector_store_path, self.embeddings)
+        return self.index_store.load(user_id, filename, self.embeddings, manifest)
 
-    def setup_rag_chat(self):
-        """Sets up and returns the RAG-enabled chat agents for a specific vector store."""
-        vector_store = FAISS.load_local("vectordb", embeddings=self.embeddings, allow_dangerous_deserialization=True)
-        print("vector Store loaded")
+    def pin_documents(self, user_id: str, documents: Optional[List[str]] = None) -> List[Dict]:
+        """Manifests of the current snapshots of the requested documents (all of the user's when
+        none are named), which every search of the chat then reads.
+
+        Documents evicted from local disk are downloaded first.
+        """
+        if not documents:
+            documents = self.tiered_store.list_documents(user_id)
+            if not documents:
+                raise ValueError(f"No documents have been uploaded for user {user_id}")
+        manifests = {document: self.tiered_store.ensure_local(user_id, document) for document in documents}
+        missing = [document for document, manifest in manifests.items() if manifest is None]
+        if missing:
+            raise ValueError(f"Vector store not found for user {user_id} and file(s) {', '.join(missing)}")
+        return list(manifests.values())
+
+    def retrieve(self, user_id: str, manifests: List[Dict], filters: Optional[Dict[str, List[str]]], question: str,
+                 k: int) -> List[Tuple[Document, float]]:
+        """Embed the question (cached, else via the shared micro-batcher) and search all pinned documents at
+        once, dense and BM25 together."""
+        batcher = get_query_batcher()
+        query_vector = query_cache.get_or_compute(batcher.embeddings.model_id, question, batcher.embed_query)
+        return get_fanout_retriever().search(self.index_store, user_id, manifests, self.embeddings, query_vector, k,
+                                             filters, question)
+
+    def setup_rag_chat(self, user_id: str, manifests: List[Dict], filters: Optional[Dict[str, List[str]]] = None):
+        """Sets up and returns the RAG-enabled chat agents searching the given pinned documents."""
+        print(f"Searching {len(manifests)} document(s)")
 
         llm_config = {
             "timeout": 600,
@@ -140,17 +190,19 @@ class RAGChatManager:
             llm_config=llm_config,
         )
 
-        ragproxyagent = RetrieveUserProxyAgent(
+        ragproxyagent = VectorStoreRetrieveUserProxyAgent(
+            search_fn=partial(self.retrieve, user_id, manifests, filters),
             name="ragproxyagent",
             system_message="Assistant for retrieving information from documents and asking questions.",
             human_input_mode="NEVER",
             max_consecutive_auto_reply=3,
             retrieve_config={
                 "task": "qa",
-                "docs_path": self.vector_store_base_path,
+                "docs_path": None,
+                # retrieve_docs searches our indices; no chromadb collection (and its embedding model) is needed.
+                "vector_db": None,
                 "chunk_token_size": 1000,
                 "model": self.config_list[0]["model"],
-                "client": vector_store,
                 "embedding_model": "sentence-transformers/all-mpnet-base-v2",
                 "get_or_create": True,
                 "context_max_tokens": 3000,
@@ -160,23 +212,34 @@ class RAGChatManager:
 
         return assistant, ragproxyagent
 
-    def start_chat(self, question: str):
-        """Starts a chat session with the specified question."""
+    def start_chat(self, question: str, user_id: str, documents: Optional[List[str]] = None,
+                   filters: Optional[Dict[str, List[str]]] = None, k: int = RETRIEVAL_TOP_K):
+        """Starts a chat session with the specified question against the user's documents.
+
+        Searches all of the user's documents unless `documents` names a subset, and only chunks
+        whose metadata matches `filters` (e.g. {"file_type": [".pdf"]}) when given; the first
+        message carries the top `k` chunks.
+        """
         try:
-            assistant, ragproxyagent = self.setup_rag_chat()
+            manifests = self.pin_documents(user_id, documents)
+            unknown = [field for field in filters or {} if field not in METADATA_INDEX_FIELDS]
+            if unknown:
+                raise ValueError(
+                    f"Cannot filter on {', '.join(unknown)}; indexed fields are {', '.join(METADATA_INDEX_FIELDS)}"
+                )
+            assistant, ragproxyagent = self.setup_rag_chat(user_id, manifests, filters)
             
+            # message_generator retrieves the context (through `retrieve`) and sets the problem
+            # that "UPDATE CONTEXT" replies search again with; a plain message skips both.
             chat_result = ragproxyagent.initiate_chat(
                 assistant,
-                message=question,
+                message=ragproxyagent.message_generator,
+                problem=question,
+                n_results=k,
                 max_turns=3,
                 clear_history=True
             )
 
-            if os.path.exists(self.vector_store_base_path):
-                shutil.rmtree(self.vector_store_base_path)
-                print(f"Cleaned up vector store at {self.vector_store_base_path}")
-
-            
             return chat_result
             
         except Exception as e:
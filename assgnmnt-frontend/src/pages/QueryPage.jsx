@@ -16,7 +16,12 @@ const QueryPage = () => {
     setAnswer(null);
 
     try {
-      const response = await axios.post("http://localhost:8000/ask", { question });
+      const token = localStorage.getItem("token");
+      const response = await axios.post(
+        "http://localhost:8000/ask",
+        { question },
+        { headers: { "Authorization": `Bearer ${token}` } }
+      );
       if (response.data.success) {
         const newAnswer = response.data.answer;
         setAnswer(newAnswer);